@@ -0,0 +1,255 @@
+import math
+import threading
+import time
+from django.core.cache import caches
+from django_api.json_helpers import EncodedJsonResponse
+from django_api.json_helpers import JsonResponseServiceUnavailable
+from django_api.json_helpers import JsonResponseTooManyRequests
+from django_api.negotiation import response_backend
+
+
+class TokenBucket(object):
+    """
+    In-process token bucket: 'rate' tokens per second, holding at most
+    'burst' tokens.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, and return 0, or the number of seconds until one is
+        available if the bucket is empty.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class SharedTokenBucket(object):
+    """
+    Rate limit shared between processes through Django's cache.
+
+    Approximates a token bucket with a fixed window of burst / rate seconds
+    that admits 'burst' requests, counted with cache.incr(). Use a cache
+    backend with atomic increments (memcached or Redis).
+    """
+
+    def __init__(self, key, rate, burst=None, cache_alias='default'):
+        self.key = key
+        self.rate = float(rate)
+        self.burst = int(burst if burst is not None else max(rate, 1))
+        self.window = self.burst / self.rate
+        self.cache_alias = cache_alias
+
+    def _window(self):
+        now = time.time()
+        number = int(now // self.window)
+        retry_after = (number + 1) * self.window - now
+        return ('%s:%d' % (self.key, number), retry_after)
+
+    def acquire(self):
+        (key, retry_after) = self._window()
+        cache = caches[self.cache_alias]
+        cache.add(key, 0, int(math.ceil(self.window)) + 1)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # The window expired between add() and incr().
+            return 0
+        return 0 if count <= self.burst else retry_after
+
+    async def aacquire(self):
+        (key, retry_after) = self._window()
+        cache = caches[self.cache_alias]
+        await cache.aadd(key, 0, int(math.ceil(self.window)) + 1)
+        try:
+            count = await cache.aincr(key)
+        except ValueError:
+            return 0
+        return 0 if count <= self.burst else retry_after
+
+
+class ConcurrencyLimit(object):
+    """
+    In-process limit of 'max_concurrent' requests in flight.
+    """
+
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.max_concurrent:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class SharedConcurrencyLimit(object):
+    """
+    Limit of 'max_concurrent' requests in flight across processes, counted
+    in Django's cache. Each request refreshes the counter's expiry, so it
+    expires 'timeout' seconds after the last request starts; set 'timeout'
+    above the longest request, so that counts leaked by crashed workers
+    are dropped without forgetting requests still in flight.
+    """
+
+    def __init__(self, key, max_concurrent, cache_alias='default',
+                 timeout=60):
+        self.key = key
+        self.max_concurrent = max_concurrent
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+
+    def acquire(self):
+        cache = caches[self.cache_alias]
+        if not cache.add(self.key, 0, self.timeout):
+            # incr() doesn't refresh the expiry.
+            cache.touch(self.key, self.timeout)
+        try:
+            count = cache.incr(self.key)
+        except ValueError:
+            return True
+        if count > self.max_concurrent:
+            self.release()
+            return False
+        return True
+
+    def release(self):
+        try:
+            caches[self.cache_alias].decr(self.key)
+        except ValueError:
+            pass
+
+    async def aacquire(self):
+        cache = caches[self.cache_alias]
+        if not await cache.aadd(self.key, 0, self.timeout):
+            await cache.atouch(self.key, self.timeout)
+        try:
+            count = await cache.aincr(self.key)
+        except ValueError:
+            return True
+        if count > self.max_concurrent:
+            await self.arelease()
+            return False
+        return True
+
+    async def arelease(self):
+        try:
+            await caches[self.cache_alias].adecr(self.key)
+        except ValueError:
+            pass
+
+
+_rejections = {}
+
+
+def _rejection_content(response_class, backend):
+    """
+    Return the encoded body of 'response_class()', computed once per
+    format.
+    """
+    key = (response_class, backend.name)
+    try:
+        return _rejections[key]
+    except KeyError:
+        _rejections[key] = response_class().content
+        return _rejections[key]
+
+
+def _reject(response_class, retry_after):
+    backend = response_backend()
+    response = EncodedJsonResponse(
+        _rejection_content(response_class, backend),
+        status=response_class.status_code,
+        content_type=backend.content_type,
+    )
+    response['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+class AdmissionControl(object):
+    """
+    Sheds load for one endpoint; see @api_limit.
+    """
+
+    def __init__(self, name, max_concurrent=None, rate=None, burst=None,
+                 shared=False, cache_alias='default', retry_after=1):
+        self.retry_after = retry_after
+        self.concurrency = None
+        self.bucket = None
+        key = 'django_api:limit:%s' % name
+        if max_concurrent is not None:
+            if shared:
+                self.concurrency = SharedConcurrencyLimit(
+                    key + ':concurrency', max_concurrent, cache_alias
+                )
+            else:
+                self.concurrency = ConcurrencyLimit(max_concurrent)
+        if rate is not None:
+            if shared:
+                self.bucket = SharedTokenBucket(
+                    key + ':rate', rate, burst, cache_alias
+                )
+            else:
+                self.bucket = TokenBucket(rate, burst)
+
+    def admit(self):
+        """
+        Return None if the request may run (call release() once it is
+        done), or the 429/503 response to send instead.
+        """
+        if self.bucket is not None:
+            wait = self.bucket.acquire()
+            if wait:
+                return _reject(JsonResponseTooManyRequests, wait)
+        if self.concurrency is not None and not self.concurrency.acquire():
+            return _reject(JsonResponseServiceUnavailable, self.retry_after)
+        return None
+
+    def release(self):
+        if self.concurrency is not None:
+            self.concurrency.release()
+
+    async def aadmit(self):
+        if self.bucket is not None:
+            if isinstance(self.bucket, SharedTokenBucket):
+                wait = await self.bucket.aacquire()
+            else:
+                wait = self.bucket.acquire()
+            if wait:
+                return _reject(JsonResponseTooManyRequests, wait)
+        if self.concurrency is not None:
+            if isinstance(self.concurrency, SharedConcurrencyLimit):
+                admitted = await self.concurrency.aacquire()
+            else:
+                admitted = self.concurrency.acquire()
+            if not admitted:
+                return _reject(JsonResponseServiceUnavailable,
+                               self.retry_after)
+        return None
+
+    async def arelease(self):
+        if isinstance(self.concurrency, SharedConcurrencyLimit):
+            await self.concurrency.arelease()
+        else:
+            self.release()
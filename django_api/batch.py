@@ -0,0 +1,251 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from asgiref.sync import async_to_sync
+from asgiref.sync import iscoroutinefunction
+from django import forms
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
+from django.http import Http404
+from django.http import HttpRequest
+from django.http import QueryDict
+from django.urls import Resolver404
+from django.urls import resolve
+from django_api import negotiation
+from django_api.decorators import validate_json_request
+from django_api.json_backends import get_backend
+from django_api.json_helpers import EncodedJsonResponse
+from django_api.json_helpers import JsonResponseBadRequest
+
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Request attributes set by middleware that sub-requests inherit.
+INHERITED_ATTRIBUTES = ('user', 'auth', 'session')
+
+BATCH_SCHEMA = [{
+    'path': str,
+    'method': forms.ChoiceField(
+        choices=[(method, method) for method in
+                 ('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE')],
+        required=False,
+    ),
+    'params': forms.Field(required=False),
+}]
+
+
+class BatchView(object):
+    """
+    A view that runs several @api calls in one HTTP request.
+
+    The POST body is a JSON array of sub-requests:
+
+    [
+        {"method": "GET", "path": "/api/courses", "params": {"page": 2}},
+        {"method": "POST", "path": "/api/enroll", "params": {"course-id": 7}}
+    ]
+
+    Each sub-request is resolved through the URLconf and dispatched
+    in-process to its view, with the batch request's headers and user, and
+    'params' as its GET data (or, for other methods, as its POST data and
+    as a JSON body). The response is an array of {"status": ...,
+    "body": ...} in the same order, where each body is the sub-request's
+    JSON response, spliced in without re-encoding.
+
+    Only views decorated with the django_api decorators can be called, since
+    sub-requests skip the middleware (including CSRF protection, which
+    applies to the batch request itself). If every sub-request uses a safe
+    method, they run concurrently on a pool of 'max_workers' threads;
+    otherwise they run one after another, in order.
+    """
+
+    def __init__(self, max_requests=None, max_workers=None):
+        self._max_requests = max_requests
+        self._max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.view = validate_json_request(BATCH_SCHEMA)(self.dispatch)
+
+    @property
+    def max_requests(self):
+        if self._max_requests is not None:
+            return self._max_requests
+        return getattr(settings, 'DJANGO_API_BATCH_MAX_REQUESTS', 20)
+
+    @property
+    def max_workers(self):
+        if self._max_workers is not None:
+            return self._max_workers
+        return getattr(settings, 'DJANGO_API_BATCH_WORKERS', 4)
+
+    def __call__(self, request):
+        if request.method != 'POST':
+            return JsonResponseBadRequest('batch requests must be POSTed')
+        return self.view(request)
+
+    def dispatch(self, request, sub_requests):
+        if len(sub_requests) > self.max_requests:
+            return JsonResponseBadRequest(
+                'at most %d requests can be batched' % self.max_requests
+            )
+        for sub_request in sub_requests:
+            if not isinstance(sub_request['params'] or {}, dict):
+                return JsonResponseBadRequest(
+                    'params of \'%s\' must be an object' % sub_request['path']
+                )
+        sub_requests = [
+            self.make_request(request, sub_request)
+            for sub_request in sub_requests
+        ]
+        if (self.max_workers > 1 and len(sub_requests) > 1 and
+                all(sub_request.method in SAFE_METHODS
+                    for sub_request in sub_requests)):
+            results = list(self.get_executor().map(
+                self.run_in_thread, sub_requests
+            ))
+        else:
+            results = [self.run(sub_request) for sub_request in sub_requests]
+        return EncodedJsonResponse(b'[%s]' % b','.join(results))
+
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='django_api_batch',
+                )
+            return self._executor
+
+    def make_request(self, request, sub_request):
+        """
+        Return an HttpRequest for one sub-request, sharing the batch
+        request's headers and authenticated user.
+        """
+        (path, query) = urlsplit(sub_request['path'])[2:4]
+        method = sub_request['method'] or 'GET'
+        params = sub_request['params'] or {}
+
+        new_request = HttpRequest()
+        new_request.method = method
+        new_request.path = new_request.path_info = path
+        new_request.META = dict(request.META)
+        new_request.META['REQUEST_METHOD'] = method
+        new_request.META['PATH_INFO'] = path
+        new_request.META['QUERY_STRING'] = query
+        # Sub-responses are spliced into the JSON batch response.
+        new_request.META['HTTP_ACCEPT'] = 'application/json'
+        # The batch request's body belongs to the batch.
+        new_request.META.pop('CONTENT_LENGTH', None)
+        new_request.META.pop('CONTENT_TYPE', None)
+        new_request.COOKIES = request.COOKIES
+        new_request.GET = QueryDict(query, mutable=True)
+        body = b''
+        if method in SAFE_METHODS:
+            _update_query_dict(new_request.GET, params)
+        else:
+            _update_query_dict(new_request.POST, params)
+            # Views that read the body (such as @validate_json_request
+            # views) get 'params' as JSON.
+            body = _encode(params)
+            new_request.META['CONTENT_TYPE'] = 'application/json'
+            new_request.META['CONTENT_LENGTH'] = str(len(body))
+            new_request.content_type = 'application/json'
+            new_request.content_params = {}
+        new_request._body = body
+        new_request._stream = io.BytesIO(body)
+        for name in INHERITED_ATTRIBUTES:
+            if hasattr(request, name):
+                setattr(new_request, name, getattr(request, name))
+        return new_request
+
+    def run_in_thread(self, request):
+        close_old_connections()
+        try:
+            return self.run(request)
+        finally:
+            close_old_connections()
+
+    def run(self, request):
+        """
+        Dispatch one sub-request and return its encoded result entry.
+        """
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return _result(404, 'no view for path \'%s\'' % request.path)
+
+        view = match.func
+        if isinstance(view, BatchView) or not getattr(
+                view, '_django_api_wrapper', False):
+            return _result(400, 'path \'%s\' cannot be batched' %
+                           request.path)
+
+        try:
+            with negotiation.negotiate(request):
+                if iscoroutinefunction(view):
+                    response = async_to_sync(view)(
+                        request, *match.args, **match.kwargs
+                    )
+                else:
+                    response = view(request, *match.args, **match.kwargs)
+        except Http404 as e:
+            return _result(404, str(e))
+        except PermissionDenied as e:
+            return _result(403, str(e))
+        except Exception:
+            logger.exception('batched request to \'%s\' failed',
+                             request.path)
+            return _result(500, 'internal error')
+        return _response_result(response)
+
+
+def _update_query_dict(query_dict, params):
+    query_dict._mutable = True
+    for (name, value) in params.items():
+        if isinstance(value, list):
+            query_dict.setlist(name, [str(item) for item in value])
+        else:
+            query_dict[name] = str(value)
+    query_dict._mutable = False
+
+
+def _encode(data):
+    content = get_backend().dumps(data)
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return content
+
+
+def _result(status, body):
+    """
+    Return the encoded {"status": ..., "body": ...} entry for a sub-request.
+    'body' is data to encode, or bytes that are already encoded JSON.
+    """
+    if not isinstance(body, bytes):
+        body = _encode(body)
+    return b'{"status":%d,"body":%s}' % (status, body)
+
+
+def _response_result(response):
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    if not content:
+        return _result(response.status_code, None)
+    if response.get('Content-Type', '').startswith('application/json'):
+        # Splice the view's JSON in as it is, rather than decoding it only
+        # to encode it again.
+        return _result(response.status_code, content)
+    return _result(response.status_code, content.decode(response.charset))
+
+
+# A batch view with the default settings, for use in a URLconf:
+#
+#     path('api/batch', batch_view)
+batch_view = BatchView()
@@ -0,0 +1,221 @@
+"""
+Benchmarks for the decorator and JSON response hot paths.
+
+Run them with the api_benchmark management command, which sets up a test
+database (use SQLite for reproducible numbers):
+
+    python manage.py api_benchmark --save-baseline bench.json
+    python manage.py api_benchmark --baseline bench.json --threshold 0.2
+"""
+import gc
+import json
+import time
+import tracemalloc
+from django import forms
+from django.contrib.auth.models import User
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django_api.decorators import api
+from django_api.decorators import api_accepts
+from django_api.json_helpers import JsonResponse
+from django_api.json_helpers import StreamingJsonResponse
+
+
+DEFAULT_SIZES = (10, 1000, 100000)
+
+
+class Benchmark(object):
+    """
+    A named callable to time. 'settings' are applied while it runs.
+    """
+
+    def __init__(self, name, func, settings=None):
+        self.name = name
+        self.func = func
+        self.settings = settings or {}
+
+    def measure(self, min_time=0.5):
+        """
+        Return {'ops_per_sec': ..., 'peak_kb': ...}: throughput over at
+        least 'min_time' seconds, and the peak memory allocated by one call.
+        """
+        with override_settings(**self.settings):
+            self.func()  # Warm up.
+
+            gc.collect()
+            tracemalloc.start()
+            try:
+                self.func()
+                (current, peak) = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            calls = 0
+            started = time.perf_counter()
+            elapsed = 0.0
+            while elapsed < min_time:
+                self.func()
+                calls += 1
+                elapsed = time.perf_counter() - started
+        return {
+            'ops_per_sec': calls / elapsed,
+            'peak_kb': peak / 1024.0,
+        }
+
+
+def _small_fields():
+    return {
+        'x': forms.IntegerField(min_value=0),
+        'y': forms.IntegerField(min_value=0),
+    }
+
+
+def _large_fields():
+    fields = {}
+    for i in range(10):
+        fields['int%d' % i] = forms.IntegerField(min_value=0)
+        fields['char%d' % i] = forms.CharField(max_length=20)
+        fields['bool%d' % i] = forms.BooleanField(required=False)
+    return fields
+
+
+def _large_data():
+    data = {}
+    for i in range(10):
+        data['int%d' % i] = str(i)
+        data['char%d' % i] = 'value %d' % i
+        data['bool%d' % i] = 'true'
+    return data
+
+
+def _view(request, *args, **kwargs):
+    return JsonResponse()
+
+
+def _consume(response):
+    for chunk in response.streaming_content:
+        pass
+
+
+def get_benchmarks(sizes=DEFAULT_SIZES):
+    """
+    Create the benchmark data (max(sizes) users) and return the list of
+    benchmarks.
+    """
+    User.objects.bulk_create([
+        User(username='bench%d' % i) for i in range(max(sizes))
+    ])
+    users = list(User.objects.order_by('pk')[:3])
+    rf = RequestFactory()
+    benchmarks = []
+
+    small_request = rf.get('/small', data={'x': '1', 'y': '2'})
+    small_view = api_accepts(_small_fields())(_view)
+    large_request = rf.get('/large', data=_large_data())
+    large_view = api_accepts(_large_fields())(_view)
+    for fast in [False, True]:
+        suffix = '_fast' if fast else ''
+        settings = {'DJANGO_API_FAST_VALIDATION': fast}
+        benchmarks.append(Benchmark(
+            'accepts_small%s' % suffix,
+            lambda: small_view(small_request),
+            settings,
+        ))
+        benchmarks.append(Benchmark(
+            'accepts_large%s' % suffix,
+            lambda: large_view(large_request),
+            settings,
+        ))
+
+    models_request = rf.get('/models', data=dict(
+        ('user%d-id' % i, user.pk) for (i, user) in enumerate(users)
+    ))
+    models_view = api_accepts(dict(
+        ('user%d' % i, User()) for i in range(len(users))
+    ))(_view)
+    benchmarks.append(Benchmark(
+        'accepts_models', lambda: models_view(models_request)
+    ))
+
+    data = dict(('key%d' % i, [i, 'value', i / 2.0]) for i in range(1000))
+    benchmarks.append(Benchmark('encode_dict', lambda: JsonResponse(data)))
+    benchmarks.append(Benchmark(
+        'encode_model', lambda: JsonResponse({'user': users[0]})
+    ))
+    for size in sizes:
+        queryset = User.objects.order_by('pk')[:size]
+        benchmarks.append(Benchmark(
+            'encode_queryset_%d' % size,
+            lambda queryset=queryset: JsonResponse(queryset.all()),
+        ))
+        benchmarks.append(Benchmark(
+            'stream_queryset_%d' % size,
+            lambda queryset=queryset: _consume(
+                StreamingJsonResponse(queryset.all())
+            ),
+        ))
+
+    @api({
+        'accepts': {
+            'x': forms.IntegerField(min_value=0),
+            'user': User(),
+        },
+        'returns': {
+            200: 'OK',
+        },
+    })
+    def round_trip_view(request):
+        return JsonResponse({
+            'x': request.GET['x'],
+            'user': request.GET['user'],
+        })
+
+    round_trip_request = rf.get('/round_trip', data={
+        'x': '1', 'user-id': users[0].pk,
+    })
+    benchmarks.append(Benchmark(
+        'api_round_trip', lambda: round_trip_view(round_trip_request)
+    ))
+    return benchmarks
+
+
+def run(benchmarks, min_time=0.5, stdout=None):
+    """
+    Measure each benchmark and return {name: result}.
+    """
+    results = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = benchmark.measure(min_time)
+        if stdout is not None:
+            stdout.write('%-28s %14.1f ops/s %12.1f KB peak' % (
+                benchmark.name,
+                results[benchmark.name]['ops_per_sec'],
+                results[benchmark.name]['peak_kb'],
+            ))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Return a list of (name, baseline ops/s, current ops/s) for benchmarks
+    whose throughput dropped by more than 'threshold' (a fraction) from
+    'baseline'.
+    """
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]['ops_per_sec']
+        if result['ops_per_sec'] < expected * (1 - threshold):
+            regressions.append((name, expected, result['ops_per_sec']))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+import uuid
+from django.core.cache import caches
+from django_api.json_helpers import EncodedJsonResponse
+from django_api.json_helpers import JsonResponse
+from django_api.response_cache import request_key
+
+
+def _share(response):
+    """
+    Return what followers need to replay 'response', or None if it can't be
+    shared (it isn't an encoded JsonResponse).
+    """
+    if not isinstance(response, JsonResponse):
+        return None
+    return (response.status_code, response.content, list(response.items()))
+
+
+def _replay(shared):
+    (status, content, headers) = shared
+    response = EncodedJsonResponse(content, status)
+    for (header, value) in headers:
+        response[header] = value
+    return response
+
+
+class _Flight(object):
+    __slots__ = ('done', 'shared')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.shared = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent identical GET requests; see @api_coalesce.
+
+    Requests are identical when they have the same path and validated input
+    (and user, with 'vary_on_user'). The first one runs the view, and the
+    others wait up to 'timeout' seconds for it and get a copy of its
+    encoded JsonResponse. If the view fails, or doesn't return a
+    JsonResponse, each waiting request runs the view itself.
+
+    With 'shared', a lock in the 'cache_alias' cache also coalesces
+    requests across processes; requests in other processes poll the cache
+    for the result every 'poll_interval' seconds.
+    """
+
+    def __init__(self, vary_on_user=False, shared=False,
+                 cache_alias='default', timeout=10, poll_interval=0.05):
+        self.vary_on_user = vary_on_user
+        self.shared = shared
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._async_flights = {}
+
+    def make_key(self, request):
+        return 'django_api:coalesce:%s' % request_key(
+            request, self.vary_on_user
+        )
+
+    def run(self, request, func):
+        """
+        Return 'func()', or a copy of the response of an identical request
+        that is already running it.
+        """
+        if request.method != 'GET':
+            return func()
+        key = self.make_key(request)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait(self.timeout)
+            if flight.shared is not None:
+                return _replay(flight.shared)
+            return func()
+
+        try:
+            if self.shared:
+                response = self._run_shared(key, func)
+            else:
+                response = func()
+            flight.shared = _share(response)
+            return response
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def arun(self, request, func):
+        """
+        Return 'await func()', coalesced like run() among the requests on
+        the same event loop.
+        """
+        if request.method != 'GET':
+            return await func()
+        loop = asyncio.get_running_loop()
+        key = self.make_key(request)
+        future = self._async_flights.get((loop, key))
+        if future is not None:
+            try:
+                shared = await asyncio.wait_for(asyncio.shield(future),
+                                                self.timeout)
+            except asyncio.TimeoutError:
+                shared = None
+            if shared is not None:
+                return _replay(shared)
+            return await func()
+
+        future = self._async_flights[(loop, key)] = loop.create_future()
+        shared = None
+        try:
+            if self.shared:
+                response = await self._arun_shared(key, func)
+            else:
+                response = await func()
+            shared = _share(response)
+            return response
+        finally:
+            del self._async_flights[(loop, key)]
+            future.set_result(shared)
+
+    def _run_shared(self, key, func):
+        cache = caches[self.cache_alias]
+        token = uuid.uuid4().hex
+        if cache.add(key, token, self.timeout):
+            try:
+                response = func()
+                shared = _share(response)
+                if shared is not None:
+                    cache.set('%s:%s' % (key, token), shared, self.timeout)
+            finally:
+                cache.delete(key)
+            return response
+
+        # Another process is running the view; wait for its result.
+        token = cache.get(key)
+        deadline = time.monotonic() + self.timeout
+        while token is not None and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            # Check the lock first: the result is stored before the lock is
+            # released.
+            running = cache.get(key) == token
+            shared = cache.get('%s:%s' % (key, token))
+            if shared is not None:
+                return _replay(shared)
+            if not running:
+                break
+        return func()
+
+    async def _arun_shared(self, key, func):
+        cache = caches[self.cache_alias]
+        token = uuid.uuid4().hex
+        if await cache.aadd(key, token, self.timeout):
+            try:
+                response = await func()
+                shared = _share(response)
+                if shared is not None:
+                    await cache.aset('%s:%s' % (key, token), shared,
+                                     self.timeout)
+            finally:
+                await cache.adelete(key)
+            return response
+
+        token = await cache.aget(key)
+        deadline = time.monotonic() + self.timeout
+        while token is not None and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            running = await cache.aget(key) == token
+            shared = await cache.aget('%s:%s' % (key, token))
+            if shared is not None:
+                return _replay(shared)
+            if not running:
+                break
+        return await func()
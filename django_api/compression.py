@@ -0,0 +1,131 @@
+import zlib
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django_api.json_helpers import JsonResponse
+from django_api.json_helpers import StreamingJsonResponse
+from django_api.negotiation import parse_quality_values
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipCompressor(object):
+    encoding = 'gzip'
+
+    def __init__(self):
+        level = getattr(settings, 'DJANGO_API_GZIP_LEVEL', 6)
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer.
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+    def compress_chunk(self, data):
+        # A sync flush makes everything written so far decodable, so each
+        # chunk can be sent right away.
+        return (self._compressor.compress(data) +
+                self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor(object):
+    encoding = 'br'
+
+    def __init__(self):
+        quality = getattr(settings, 'DJANGO_API_BROTLI_QUALITY', 4)
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.finish()
+
+    def compress_chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def get_compressor(accept_encoding):
+    """
+    Return a compressor class for the preferred encoding in an
+    Accept-Encoding header, or None if nothing we support is acceptable.
+
+    Brotli (if installed) is preferred over gzip at equal quality values.
+    """
+    available = {'gzip': GzipCompressor}
+    if brotli is not None:
+        available['br'] = BrotliCompressor
+
+    qualities = parse_quality_values(accept_encoding)
+
+    best = None
+    for name in ['br', 'gzip']:
+        if name not in available:
+            continue
+        quality = qualities.get(name, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[0]):
+            best = (quality, available[name])
+    return best[1] if best else None
+
+
+def compress_response(request, response):
+    """
+    Compress a JsonResponse or StreamingJsonResponse for 'request', using the
+    best encoding its Accept-Encoding header allows.
+
+    Responses smaller than the DJANGO_API_COMPRESS_MIN_SIZE setting (in
+    bytes, default 1024) are left alone. Streaming responses are compressed
+    chunk by chunk as they are sent.
+    """
+    if not isinstance(response, (JsonResponse, StreamingJsonResponse)):
+        return response
+    if response.has_header('Content-Encoding'):
+        return response
+    if getattr(response, 'is_async', False):
+        return response
+    min_size = getattr(settings, 'DJANGO_API_COMPRESS_MIN_SIZE', 1024)
+    if not response.streaming and len(response.content) < min_size:
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    compressor_class = get_compressor(
+        request.META.get('HTTP_ACCEPT_ENCODING', '')
+    )
+    if compressor_class is None:
+        return response
+
+    compressor = compressor_class()
+    if response.streaming:
+        response.streaming_content = _compress_sequence(
+            compressor, response.streaming_content
+        )
+        if response.has_header('Content-Length'):
+            del response['Content-Length']
+    else:
+        content = compressor.compress(response.content)
+        # Return the compressed content only if it's actually shorter.
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+
+    # The compressed body is not byte-identical to the original, so a strong
+    # ETag becomes weak.
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    response['Content-Encoding'] = compressor.encoding
+    return response
+
+
+def _compress_sequence(compressor, sequence):
+    for chunk in sequence:
+        data = compressor.compress_chunk(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
@@ -1,15 +1,28 @@
-import json
-import logging
+from functools import partial
 from functools import wraps
-from django import forms
+from asgiref.sync import async_to_sync
+from asgiref.sync import iscoroutinefunction
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import models
+from django_api import failures
+from django_api import negotiation
+from django_api import timing
+from django_api.admission import AdmissionControl
+from django_api.coalescing import SingleFlight
+from django_api.ingest import read_records
 from django_api.json_helpers import JsonResponse
 from django_api.json_helpers import JsonResponseBadRequest
 from django_api.json_helpers import JsonResponseNotFound
-
-
-logger = logging.getLogger(__name__)
+from django_api.json_helpers import JsonResponseNotSupported
+from django_api.json_helpers import JsonResponseTooLarge
+from django_api.json_helpers import StreamingJsonResponse
+from django_api.query_budget import QueryBudget
+from django_api.response_cache import ResponseCache
+from django_api.sampling import ValidationPolicy
+from django_api.schema import AcceptsSchema
+from django_api.schema import JsonSchema
+from django_api.schema import ObjectNotFound
+from django_api.tasks import BackgroundTask
 
 
 class ValidatedRequest(object):
@@ -32,6 +45,124 @@ class ValidatedRequest(object):
             return object.__getattribute__(self._orig_request, name)
 
 
+def _identity_map(request):
+    """
+    Return the model identity map for 'request', shared by every
+    @api_accepts that handles it.
+    """
+    try:
+        return request._django_api_identity_map
+    except AttributeError:
+        request._django_api_identity_map = {}
+        return request._django_api_identity_map
+
+
+def _format_input_error(path, field, value, error):
+    return '%s %s=%.100r: %s' % (path, field, value, '; '.join(error.messages))
+
+
+def _invalid_input(request, form, endpoint):
+    """
+    Return the response for input that failed to validate, or None if the
+    view should be called anyway (the failure is counted, see
+    django_api.failures).
+    """
+    if settings.DEBUG:
+        return JsonResponseBadRequest(
+            'failed to validate: %s' % dict(form.errors)
+        )
+    for (field, errors) in form.errors.items():
+        value = form.data.get(field)
+        for error in errors.as_data():
+            failures.record(endpoint, field, error.code or 'invalid',
+                            _format_input_error, request.path, field, value,
+                            error)
+
+
+def _field_not_present(e):
+    return JsonResponseBadRequest('field %s not present' % e.args[0])
+
+
+def _object_not_found(e):
+    return JsonResponseNotFound(
+        '%s with pk=%d does not exist' % (e.model, e.pk)
+    )
+
+
+def _validate_input(schema, request, endpoint):
+    """
+    Validate the GET/POST data of 'request' against 'schema'.
+
+    Return (form, None) if it is valid, (None, None) if the view should be
+    called with the original request anyway, or (None, error response).
+    """
+    with timing.phase('validate'):
+        form = schema.bind(getattr(request, request.method))
+        is_valid = form.is_valid()
+    if is_valid:
+        return (form, None)
+    return (None, _invalid_input(request, form, endpoint))
+
+
+def _clean_request(schema, request, endpoint):
+    """
+    Return (request for the view, None), or (None, error response).
+
+    The request for the view is a ValidatedRequest whose GET/POST data has
+    been cleaned by 'schema', with model fields looked up.
+    """
+    if request.method not in ['GET', 'POST']:
+        return (request, None)
+    (form, response) = _validate_input(schema, request, endpoint)
+    if form is None:
+        return (None, response) if response is not None else (request, None)
+
+    # Clean any models.Model fields, by looking up objects based on
+    # primary keys in request.
+    if schema.model_fields:
+        try:
+            field_pks = schema.model_pks(request)
+        except KeyError as e:
+            return (None, _field_not_present(e))
+        try:
+            with timing.phase('models'):
+                objects = schema.resolve_models(
+                    field_pks, _identity_map(request)
+                )
+        except ObjectNotFound as e:
+            return (None, _object_not_found(e))
+        form.cleaned_data.update(objects)
+
+    return (ValidatedRequest(request, form), None)
+
+
+async def _aclean_request(schema, request, endpoint):
+    """
+    Async version of _clean_request().
+    """
+    if request.method not in ['GET', 'POST']:
+        return (request, None)
+    (form, response) = _validate_input(schema, request, endpoint)
+    if form is None:
+        return (None, response) if response is not None else (request, None)
+
+    if schema.model_fields:
+        try:
+            field_pks = schema.model_pks(request)
+        except KeyError as e:
+            return (None, _field_not_present(e))
+        try:
+            with timing.phase('models'):
+                objects = await schema.aresolve_models(
+                    field_pks, _identity_map(request)
+                )
+        except ObjectNotFound as e:
+            return (None, _object_not_found(e))
+        form.cleaned_data.update(objects)
+
+    return (ValidatedRequest(request, form), None)
+
+
 def api_accepts(fields):
     """
     Define the accept schema of an API (GET or POST).
@@ -44,8 +175,9 @@ def api_accepts(fields):
 
     In debug and test modes, failure to validate the fields will result in a
     400 Bad Request response.
-    In production mode, failure to validate will just log a
-    warning, unless overwritten by a 'strict' setting.
+    In production mode, failure to validate will just be counted and
+    periodically logged (see django_api.failures), unless overwritten by a
+    'strict' setting.
 
     For example:
 
@@ -66,60 +198,127 @@ def api_accepts(fields):
     and pick the object that has that primary key. For example, if the entry is
     {'course': Course()}, it will search for the key course_id='course-id' in
     the request object, and find the object Course.objects.get(pk=course_id)
+    Model fields are fetched with one query per model class; use ModelLookup
+    instead of Model() to add select_related/prefetch_related/only hints.
+    Models registered with django_api.model_cache are served from the cache.
     """
     def decorator(func):
+        schema = AcceptsSchema(fields)
+        endpoint = timing.endpoint_name(func)
+        view_phase = timing.view_phase(func)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                (view_request, response) = await _aclean_request(
+                    schema, request, endpoint
+                )
+                if response is not None:
+                    return response
+                with timing.phase(view_phase):
+                    return await func(view_request, *args, **kwargs)
+            return timing.instrument(async_wrapped_func, func)
+
         @wraps(func)
         def wrapped_func(request, *args, **kwargs):
-            if request.method not in ['GET', 'POST']:
-                return func(request, *args, **kwargs)
+            (view_request, response) = _clean_request(schema, request,
+                                                      endpoint)
+            if response is not None:
+                return response
+            with timing.phase(view_phase):
+                return func(view_request, *args, **kwargs)
+        return timing.instrument(wrapped_func, func)
+    return decorator
 
-            # The fields dict passed into the type() function is modified, so
-            # send in a copy instead.
-            form_class = type('ApiForm', (forms.Form,), fields.copy())
-            form = form_class(getattr(request, request.method))
 
-            if not form.is_valid():
-                if settings.DEBUG:
-                    return JsonResponseBadRequest(
-                        'failed to validate: %s' % dict(form.errors)
-                    )
-                else:
-                    logger.warn(
-                        'input to \'%s\' failed to validate: %s',
-                        request.path,
-                        dict(form.errors)
-                    )
-                    return func(request, *args, **kwargs)
+def _return_codes(return_values):
+    """
+    Return the sorted list of status codes allowed by 'return_values'.
+    """
+    # Never block 500s - these should be handled by other
+    # reporting mechanisms
+    return sorted(set(return_values) | set([500]))
 
-            # Clean any models.Model fields, by looking up object based on
-            # primary key in request.
-            for (field_name, field_instance) in fields.items():
-                if isinstance(field_instance, models.Model):
-                    field_type = type(field_instance)
-                    # TODO: irregular, should we remove?
-                    field_id = '%s-id' % field_name
-                    if field_id not in request.REQUEST:
-                        return JsonResponseBadRequest(
-                            'field %s not present' % field_name
-                        )
-                    field_pk = int(request.REQUEST[field_id])
-                    try:
-                        field_value = field_type.objects.get(pk=field_pk)
-                    except field_type.DoesNotExist:
-                        return JsonResponseNotFound(
-                            '%s with pk=%d does not exist' % (
-                                field_type, field_pk
-                            )
-                        )
-                    form.cleaned_data[field_name] = field_value
-
-            validated_request = ValidatedRequest(request, form)
-            return func(validated_request, *args, **kwargs)
-        return wrapped_func
-    return decorator
+
+def _format_not_json(response_class):
+    return 'returned %s' % response_class.__name__
 
 
-def api_returns(return_values):
+def _format_undeclared_status(status_code, accepted_return_codes):
+    return 'returned %d instead of acceptable values %s' % (
+        status_code, accepted_return_codes
+    )
+
+
+def _check_response(accepted_return_codes, return_value, endpoint):
+    """
+    Validate 'return_value' against the accepted status codes, and return
+    the response to send. In production, failures are only counted (see
+    django_api.failures).
+    """
+    if not isinstance(return_value, (JsonResponse, StreamingJsonResponse)):
+        if settings.DEBUG:
+            return JsonResponseBadRequest('API did not return JSON')
+        else:
+            failures.record(endpoint, 'response', 'not_json',
+                            _format_not_json, return_value.__class__)
+
+    if return_value.status_code not in accepted_return_codes:
+        if settings.DEBUG:
+            return JsonResponseBadRequest(
+                'API returned %d instead of acceptable values %s' %
+                (return_value.status_code, accepted_return_codes)
+            )
+        else:
+            failures.record(endpoint, 'response', 'undeclared_status',
+                            _format_undeclared_status,
+                            return_value.status_code, accepted_return_codes)
+
+    return return_value
+
+
+def _validate_response(policy, accepted_return_codes, return_value,
+                       endpoint, budget=None, counter=None):
+    """
+    Check 'return_value' as _check_response() does, when 'policy' (a
+    ValidationPolicy) samples it in, and return the response to send.
+
+    If 'counter' has the queries of the view, they are checked against
+    'budget' (a QueryBudget) too.
+    """
+    checked = policy.run(_check_response, accepted_return_codes,
+                         return_value, endpoint)
+    if checked is not None:
+        return_value = checked
+    if counter is not None:
+        return_value = budget.enforce(endpoint, counter, return_value)
+    return return_value
+
+
+def _query_budget(max_queries, max_db_time):
+    if max_queries is None and max_db_time is None:
+        return None
+    return QueryBudget(max_queries, max_db_time)
+
+
+def _run_view(budget, policy, func, *args, **kwargs):
+    """
+    Return (func(*args, **kwargs), QueryCounter or None), counting queries
+    if there is a query 'budget' and 'policy' samples this request.
+    """
+    if budget is None or not policy.should_check():
+        return (func(*args, **kwargs), None)
+    return budget.call(func, *args, **kwargs)
+
+
+async def _arun_view(budget, policy, func, *args, **kwargs):
+    if budget is None or not policy.should_check():
+        return (await func(*args, **kwargs), None)
+    return await budget.acall(func, *args, **kwargs)
+
+
+def api_returns(return_values, sample_rate=None, mode=None, max_queries=None,
+                max_db_time=None):
     """
     Define the return schema of an API.
 
@@ -131,8 +330,19 @@ def api_returns(return_values):
 
     In debug and test modes, failure to validate the fields will result in a
     400 Bad Request response.
-    In production mode, failure to validate will just log a
-    warning, unless overwritten by a 'strict' setting.
+    In production mode, failure to validate will just be counted and
+    periodically logged (see django_api.failures), unless overwritten by a
+    'strict' setting.
+
+    Since production failures are only counted, production checks can be
+    sampled: 'sample_rate' is the fraction of requests checked, and a 'mode'
+    of 'shadow' checks them in a background thread instead of before
+    returning. See django_api.sampling.ValidationPolicy.
+
+    'max_queries' and 'max_db_time' (in seconds) declare the query budget of
+    the view, including queries run while its response is encoded. Over
+    budget, DEBUG mode returns a 400; in production, sampled requests are
+    measured and breaches are counted (see django_api.failures).
 
     For example:
 
@@ -148,43 +358,388 @@ def api_returns(return_values):
 
         return HttpResponse()  # 200
     """
+    accepted_return_codes = _return_codes(return_values)
+    policy = ValidationPolicy(sample_rate, mode)
+    budget = _query_budget(max_queries, max_db_time)
+
     def decorator(func):
+        endpoint = timing.endpoint_name(func)
+        view_phase = timing.view_phase(func)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                with timing.phase(view_phase):
+                    (return_value, counter) = await _arun_view(
+                        budget, policy, func, request, *args, **kwargs
+                    )
+                return _validate_response(
+                    policy, accepted_return_codes, return_value, endpoint,
+                    budget, counter
+                )
+            return timing.instrument(async_wrapped_func, func)
+
         @wraps(func)
         def wrapped_func(request, *args, **kwargs):
-            return_value = func(request, *args, **kwargs)
-
-            if not isinstance(return_value, JsonResponse):
-                if settings.DEBUG:
-                    return JsonResponseBadRequest('API did not return JSON')
-                else:
-                    logger.warn('API did not return JSON')
-
-            accepted_return_codes = return_values.keys()
-            # Never block 500s - these should be handled by other
-            # reporting mechanisms
-            accepted_return_codes.append(500)
-
-            if return_value.status_code not in accepted_return_codes:
-                if settings.DEBUG:
-                    return JsonResponseBadRequest(
-                        'API returned %d instead of acceptable values %s' %
-                        (return_value.status_code, accepted_return_codes)
-                    )
-                else:
-                    logger.warn(
-                        'API returned %d instead of acceptable values %s',
-                        return_value.status_code,
-                        accepted_return_codes,
-                    )
+            with timing.phase(view_phase):
+                (return_value, counter) = _run_view(
+                    budget, policy, func, request, *args, **kwargs
+                )
+            return _validate_response(
+                policy, accepted_return_codes, return_value, endpoint,
+                budget, counter
+            )
+        return timing.instrument(wrapped_func, func)
+    return decorator
 
-            return return_value
-        return wrapped_func
+
+def api_cache(timeout=60, vary_on_user=False, max_size=1024 * 1024,
+              cache_alias='default'):
+    """
+    Cache the responses of a read-only API.
+
+    GET responses with a 200 status are stored in Django's cache for
+    'timeout' seconds, keyed on the request path and the validated input
+    (the cleaned_data from @api_accepts, which must be applied first).
+    With 'vary_on_user', the current user is part of the key. Responses
+    larger than 'max_size' bytes are not cached.
+
+    Responses carry an ETag computed from their content. A request whose
+    If-None-Match matches a cached response gets a 304 Not Modified without
+    running the view.
+
+    For example:
+
+    @api_accepts({
+        'course': Course(),
+    })
+    @api_cache(timeout=300)
+    def course_info(request, *args, **kwargs):
+        return JsonResponse({'course': request.GET['course']})
+
+    In @api, pass the same options under a 'cache' key:
+
+    @api({
+        'accepts': {...},
+        'returns': {...},
+        'cache': {'timeout': 300, 'vary_on_user': True},
+    })
+    """
+    response_cache = ResponseCache(timeout, vary_on_user, max_size,
+                                   cache_alias)
+
+    def decorator(func):
+        view_phase = timing.view_phase(func)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                if request.method != 'GET':
+                    with timing.phase(view_phase):
+                        return await func(request, *args, **kwargs)
+
+                (key, response) = await response_cache.aget(request)
+                if response is not None:
+                    return response
+                with timing.phase(view_phase):
+                    response = await func(request, *args, **kwargs)
+                return await response_cache.aset(request, key, response)
+            return timing.instrument(async_wrapped_func, func)
+
+        @wraps(func)
+        def wrapped_func(request, *args, **kwargs):
+            if request.method != 'GET':
+                with timing.phase(view_phase):
+                    return func(request, *args, **kwargs)
+
+            (key, response) = response_cache.get(request)
+            if response is not None:
+                return response
+            with timing.phase(view_phase):
+                response = func(request, *args, **kwargs)
+            return response_cache.set(request, key, response)
+        return timing.instrument(wrapped_func, func)
+    return decorator
+
+
+def api_limit(max_concurrent=None, rate=None, burst=None, shared=False,
+              cache_alias='default', retry_after=1):
+    """
+    Shed load before it saturates the workers.
+
+    Requests beyond 'max_concurrent' in flight get a 503, and requests
+    beyond 'rate' per second (with bursts of up to 'burst', default 'rate')
+    get a 429, both with a Retry-After header and without running the view
+    or validating input. The 503's Retry-After is 'retry_after' seconds.
+
+    Limits are kept per process. With 'shared', they are counted in the
+    'cache_alias' cache instead, across processes, at the cost of cache
+    round trips on every request; the rate is then approximated with a
+    fixed window.
+
+    For example:
+
+    @api_limit(max_concurrent=20, rate=100)
+    @api_accepts({...})
+    def search(request):
+        ...
+
+    In @api, pass the same options under a 'limits' key.
+    """
+    def decorator(func):
+        limits = AdmissionControl(timing.endpoint_name(func), max_concurrent,
+                                  rate, burst, shared, cache_alias,
+                                  retry_after)
+        view_phase = timing.view_phase(func)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                response = await limits.aadmit()
+                if response is not None:
+                    return response
+                try:
+                    with timing.phase(view_phase):
+                        return await func(request, *args, **kwargs)
+                finally:
+                    await limits.arelease()
+            return timing.instrument(async_wrapped_func, func)
+
+        @wraps(func)
+        def wrapped_func(request, *args, **kwargs):
+            response = limits.admit()
+            if response is not None:
+                return response
+            try:
+                with timing.phase(view_phase):
+                    return func(request, *args, **kwargs)
+            finally:
+                limits.release()
+        return timing.instrument(wrapped_func, func)
     return decorator
 
 
+def api_coalesce(vary_on_user=False, shared=False, cache_alias='default',
+                 timeout=10, poll_interval=0.05):
+    """
+    Coalesce concurrent identical GET requests to a read-only API.
+
+    While one request runs the view, identical requests (same path and
+    validated input, from @api_accepts, which must be applied first) wait
+    for it and get a copy of its encoded JsonResponse, instead of running
+    the view and the encoder again. With 'vary_on_user', the current user
+    is part of the key.
+
+    With 'shared', requests are also coalesced across processes, through a
+    lock in the 'cache_alias' cache; see coalescing.SingleFlight. For
+    example:
+
+    @api_accepts({
+        'course': Course(),
+    })
+    @api_coalesce(shared=True)
+    def course_info(request, *args, **kwargs):
+        return JsonResponse({'course': request.GET['course']})
+
+    In @api, pass the same options under a 'coalesce' key.
+    """
+    single_flight = SingleFlight(vary_on_user, shared, cache_alias, timeout,
+                                 poll_interval)
+
+    def decorator(func):
+        view_phase = timing.view_phase(func)
+
+        if iscoroutinefunction(func):
+            async def async_call(request, *args, **kwargs):
+                with timing.phase(view_phase):
+                    return await func(request, *args, **kwargs)
+
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                return await single_flight.arun(
+                    request, lambda: async_call(request, *args, **kwargs)
+                )
+            return timing.instrument(async_wrapped_func, func)
+
+        def call(request, *args, **kwargs):
+            with timing.phase(view_phase):
+                return func(request, *args, **kwargs)
+
+        @wraps(func)
+        def wrapped_func(request, *args, **kwargs):
+            return single_flight.run(
+                request, lambda: call(request, *args, **kwargs)
+            )
+        return timing.instrument(wrapped_func, func)
+    return decorator
+
+
+class ApiEndpoint(object):
+    """
+    An @api view, compiled once when the decorator is applied.
+
+    Holds everything @api needs per request (the compiled accepts schema,
+    the accepted status codes, the admission limits, the response cache,
+    request coalescing, the background task queue and the view) and runs
+    the whole pipeline in dispatch(), instead of going through a chain of
+    decorators. Available for introspection as 'view.endpoint'.
+    """
+
+    def __init__(self, view, accept_return_dict):
+        self.view = view
+        self.name = timing.endpoint_name(view)
+        self.accepts = accept_return_dict['accepts']
+        self.returns = accept_return_dict['returns']
+        self.schema = AcceptsSchema(self.accepts)
+        self.return_codes = _return_codes(self.returns)
+        self.validation = ValidationPolicy(
+            **accept_return_dict.get('validation', {})
+        )
+        self.query_budget = _query_budget(
+            accept_return_dict.get('max_queries'),
+            accept_return_dict.get('max_db_time'),
+        )
+        self.cache = None
+        if 'cache' in accept_return_dict:
+            self.cache = ResponseCache(**accept_return_dict['cache'])
+        self.coalesce = None
+        if 'coalesce' in accept_return_dict:
+            self.coalesce = SingleFlight(**accept_return_dict['coalesce'])
+        self.limits = None
+        if 'limits' in accept_return_dict:
+            self.limits = AdmissionControl(
+                self.name, **accept_return_dict['limits']
+            )
+        self.task = None
+        if 'async_task' in accept_return_dict:
+            self.task = BackgroundTask(**accept_return_dict['async_task'])
+
+    def __repr__(self):
+        return '<ApiEndpoint %s>' % self.name
+
+    def dispatch(self, request, *args, **kwargs):
+        with negotiation.negotiate(request):
+            response = self._admit(request, *args, **kwargs)
+        return negotiation.vary(response)
+
+    async def adispatch(self, request, *args, **kwargs):
+        with negotiation.negotiate(request):
+            response = await self._aadmit(request, *args, **kwargs)
+        return negotiation.vary(response)
+
+    def _admit(self, request, *args, **kwargs):
+        if self.limits is None:
+            return self._dispatch(request, *args, **kwargs)
+        response = self.limits.admit()
+        if response is not None:
+            return response
+        try:
+            return self._dispatch(request, *args, **kwargs)
+        finally:
+            self.limits.release()
+
+    async def _aadmit(self, request, *args, **kwargs):
+        if self.limits is None:
+            return await self._adispatch(request, *args, **kwargs)
+        response = await self.limits.aadmit()
+        if response is not None:
+            return response
+        try:
+            return await self._adispatch(request, *args, **kwargs)
+        finally:
+            await self.limits.arelease()
+
+    def _dispatch(self, request, *args, **kwargs):
+        (view_request, response) = _clean_request(self.schema, request,
+                                                  self.name)
+        if response is not None:
+            return response
+
+        if self.task is not None:
+            return self.task.submit(view_request, partial(
+                self._call_view, view_request, *args, **kwargs
+            ))
+
+        # Cached responses were validated by @api_returns when they were
+        # produced, so they are returned as they are.
+        use_cache = self.cache is not None and request.method == 'GET'
+        if use_cache:
+            (key, response) = self.cache.get(view_request)
+            if response is not None:
+                return response
+
+        if self.coalesce is not None:
+            response = self.coalesce.run(view_request, lambda: self._call_view(
+                view_request, *args, **kwargs
+            ))
+        else:
+            response = self._call_view(view_request, *args, **kwargs)
+
+        if use_cache:
+            response = self.cache.set(view_request, key, response)
+        return response
+
+    def _call_view(self, view_request, *args, **kwargs):
+        with timing.phase('view'):
+            (response, counter) = _run_view(
+                self.query_budget, self.validation, self.view, view_request,
+                *args, **kwargs
+            )
+        return _validate_response(
+            self.validation, self.return_codes, response, self.name,
+            self.query_budget, counter
+        )
+
+    async def _adispatch(self, request, *args, **kwargs):
+        (view_request, response) = await _aclean_request(
+            self.schema, request, self.name
+        )
+        if response is not None:
+            return response
+
+        if self.task is not None:
+            return await sync_to_async(self.task.submit)(
+                view_request, partial(async_to_sync(self._acall_view),
+                                      view_request, *args, **kwargs)
+            )
+
+        use_cache = self.cache is not None and request.method == 'GET'
+        if use_cache:
+            (key, response) = await self.cache.aget(view_request)
+            if response is not None:
+                return response
+
+        if self.coalesce is not None:
+            response = await self.coalesce.arun(
+                view_request,
+                lambda: self._acall_view(view_request, *args, **kwargs),
+            )
+        else:
+            response = await self._acall_view(view_request, *args, **kwargs)
+
+        if use_cache:
+            response = await self.cache.aset(view_request, key, response)
+        return response
+
+    async def _acall_view(self, view_request, *args, **kwargs):
+        with timing.phase('view'):
+            (response, counter) = await _arun_view(
+                self.query_budget, self.validation, self.view, view_request,
+                *args, **kwargs
+            )
+        return _validate_response(
+            self.validation, self.return_codes, response, self.name,
+            self.query_budget, counter
+        )
+
+
 def api(accept_return_dict):
     """
-    Wrapper that calls @api_accepts and @api_returns in sequence.
+    Wrapper that applies @api_accepts and @api_returns (and optionally
+    @api_limit, @api_cache and @api_coalesce) in sequence. The whole spec is
+    compiled into an ApiEndpoint when the decorator is applied, available as
+    'view.endpoint'. JsonResponses are encoded in the format the request
+    accepts, such as MessagePack; see negotiation.
     For example:
 
     @api({
@@ -197,7 +752,32 @@ def api(accept_return_dict):
             403: 'User does not have persion',
             404: 'Resource not found',
             404: 'User not found',
-        ]
+        ],
+        # Optional, see @api_cache.
+        'cache': {
+            'timeout': 60,
+        },
+        # Optional, see @api_limit.
+        'limits': {
+            'max_concurrent': 20,
+            'rate': 100,
+        },
+        # Optional, see @api_coalesce.
+        'coalesce': {
+            'vary_on_user': False,
+        },
+        # Optional: run the view in the background, and return 202 with a
+        # job id for django_api.tasks.job_status. Takes 'executor',
+        # 'max_pending' and 'store'; see django_api.tasks.
+        'async_task': {},
+        # Optional, see @api_returns.
+        'max_queries': 5,
+        'max_db_time': 0.1,
+        # Optional, see @api_returns.
+        'validation': {
+            'sample_rate': 0.01,
+            'mode': 'shadow',
+        },
     })
     def add(request, *args, **kwargs):
         if not request.GET['x'] == 10:
@@ -206,19 +786,26 @@ def api(accept_return_dict):
         return HttpResponse()  # 200
     """
     def decorator(func):
+        endpoint = ApiEndpoint(func, accept_return_dict)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                return await endpoint.adispatch(request, *args, **kwargs)
+            async_wrapped_func = timing.instrument(async_wrapped_func, func)
+            async_wrapped_func.endpoint = endpoint
+            return async_wrapped_func
+
         @wraps(func)
         def wrapped_func(request, *args, **kwargs):
-            @api_accepts(accept_return_dict['accepts'])
-            @api_returns(accept_return_dict['returns'])
-            def apid_fnc(request, *args, **kwargs):
-                return func(request, *args, **kwargs)
-
-            return apid_fnc(request, *args, **kwargs)
+            return endpoint.dispatch(request, *args, **kwargs)
+        wrapped_func = timing.instrument(wrapped_func, func)
+        wrapped_func.endpoint = endpoint
         return wrapped_func
     return decorator
 
 
-def validate_json_request(required_fields):
+def validate_json_request(required_fields, max_size=None, stream=False):
     """
     Return a decorator that ensures that the request passed to the view
     function/method has a valid JSON request body with the given required
@@ -228,20 +815,159 @@ def validate_json_request(required_fields):
     @json_request({'name', 'date'})
     def view_func(request, request_dict):
         ...
+
+    'required_fields' may also be a typed spec (see schema.JsonSchema),
+    in which case the view receives the cleaned data instead:
+
+    @validate_json_request({
+        'name': forms.CharField(max_length=100),
+        'items': [{'sku': str, 'quantity': forms.IntegerField(min_value=1)}],
+    })
+    def view_func(request, request_dict):
+        ...
+
+    Bodies larger than 'max_size' bytes (default: the
+    DJANGO_API_MAX_JSON_SIZE setting, 2.5 MB) are rejected with a 413
+    before they are decoded.
+
+    Bodies in a binary format enabled for content negotiation (such as
+    MessagePack, with an application/msgpack Content-Type) are decoded
+    with that format instead, and the view's JsonResponse is encoded in
+    the format the request accepts; see negotiation.
+
+    With 'stream', the body is a bulk upload: NDJSON (one record per line,
+    for an application/x-ndjson Content-Type) or a JSON array of records.
+    A MessagePack body is a sequence of packed records. It is read
+    incrementally, and the view receives an ingest.RecordStream
+    that yields each record accepted by 'required_fields', so memory use
+    does not grow with the upload. 'max_size' then limits each record. If
+    the view returns None, the response summarizes the records read and
+    the errors of the rejected ones:
+
+    @validate_json_request({'sku': str, 'quantity': int}, stream=True)
+    def import_items(request, records):
+        for record in records:
+            ...
     """
+    schema = JsonSchema(required_fields)
+
     def decorator(func):
+        view_phase = timing.view_phase(func)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapped_func(request, *args, **kwargs):
+                with negotiation.negotiate(request):
+                    response = await _aread_and_call(request, *args,
+                                                     **kwargs)
+                return negotiation.vary(response)
+
+            async def _aread_and_call(request, *args, **kwargs):
+                with timing.phase('validate'):
+                    (request_dict, response) = _read_json_request(
+                        request, schema, max_size, stream
+                    )
+                if response is not None:
+                    return response
+                with timing.phase(view_phase):
+                    response = await func(request, request_dict, *args,
+                                          **kwargs)
+                if stream:
+                    return _records_response(request_dict, response)
+                return response
+            return timing.instrument(async_wrapped_func, func)
+
         @wraps(func)
         def wrapped_func(request, *args, **kwargs):
-            try:
-                request_dict = json.loads(request.raw_post_data)
-            except ValueError as e:
-                return JsonResponseBadRequest('invalid POST JSON: %s' % e)
+            with negotiation.negotiate(request):
+                response = _read_and_call(request, *args, **kwargs)
+            return negotiation.vary(response)
+
+        def _read_and_call(request, *args, **kwargs):
+            with timing.phase('validate'):
+                (request_dict, response) = _read_json_request(
+                    request, schema, max_size, stream
+                )
+            if response is not None:
+                return response
+            with timing.phase(view_phase):
+                response = func(request, request_dict, *args, **kwargs)
+            if stream:
+                return _records_response(request_dict, response)
+            return response
+        return timing.instrument(wrapped_func, func)
+    return decorator
 
-            for k in required_fields:
-                if k not in request_dict:
-                    return JsonResponseBadRequest(
-                        'POST JSON must contain property \'%s\'' % k)
 
-            return func(request, request_dict, *args, **kwargs)
-        return wrapped_func
-    return decorator
+def _read_json_request(request, schema, max_size, stream):
+    """
+    Return (request_dict or RecordStream, None), or (None, error response).
+    """
+    if stream:
+        if negotiation.request_backend(request) is None:
+            return (None, _not_supported(request))
+        return (read_records(request, schema, _json_size_limit(max_size)),
+                None)
+    return _parse_json_request(request, schema, max_size)
+
+
+def _records_response(records, response):
+    """
+    Return the view's response, or a summary of 'records' if it returned
+    None.
+    """
+    if response is not None:
+        return response
+    if records.error is not None:
+        return JsonResponseBadRequest(records.summary())
+    return JsonResponse(records.summary())
+
+
+def _json_size_limit(max_size):
+    if max_size is not None:
+        return max_size
+    return getattr(settings, 'DJANGO_API_MAX_JSON_SIZE', 2621440)
+
+
+def _too_large(max_size):
+    return JsonResponseTooLarge(
+        'POST JSON is larger than %d bytes' % max_size
+    )
+
+
+def _not_supported(request):
+    return JsonResponseNotSupported(
+        'Content-Type %s is not supported' % request.content_type
+    )
+
+
+def _parse_json_request(request, schema, max_size):
+    """
+    Return (request_dict, None), or (None, error response).
+    """
+    max_size = _json_size_limit(max_size)
+    if max_size is not None:
+        # Check the declared length before reading the body at all.
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > max_size:
+            return (None, _too_large(max_size))
+        if len(request.body) > max_size:
+            return (None, _too_large(max_size))
+
+    backend = negotiation.request_backend(request)
+    if backend is None:
+        return (None, _not_supported(request))
+    try:
+        request_dict = backend.loads(request.body)
+    except ValueError as e:
+        return (None, JsonResponseBadRequest('invalid POST JSON: %s' % e))
+
+    (request_dict, errors) = schema.clean(request_dict)
+    if errors:
+        return (None, JsonResponseBadRequest(
+            'POST JSON failed to validate: %s' % dict(errors)
+        ))
+    return (request_dict, None)
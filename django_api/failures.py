@@ -0,0 +1,159 @@
+"""
+Aggregated reporting of the validation failures that api_accepts and
+api_returns let through in production.
+
+Each failure only increments a counter keyed by (endpoint, field, error
+code). DJANGO_API_FAILURE_FLUSH_INTERVAL seconds (default 60) after the
+first failure of a window, a background timer flushes the counts to the
+registered sinks, with up to DJANGO_API_FAILURE_EXEMPLARS (default 3)
+sampled examples per key. Only the sampled examples are ever formatted.
+"""
+import atexit
+import logging
+import random
+import threading
+import time
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_sinks = []
+
+
+class FailureAggregator(object):
+    """
+    Counts failures per (endpoint, field, code), and keeps a random sample
+    of exemplars for each.
+    """
+
+    def __init__(self, flush_interval=None, max_exemplars=None):
+        self._flush_interval = flush_interval
+        self._max_exemplars = max_exemplars
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._next_flush = None
+        self._timer = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'DJANGO_API_FAILURE_FLUSH_INTERVAL', 60)
+
+    @property
+    def max_exemplars(self):
+        if self._max_exemplars is not None:
+            return self._max_exemplars
+        return getattr(settings, 'DJANGO_API_FAILURE_EXEMPLARS', 3)
+
+    def record(self, endpoint, field, code, format_exemplar=None, *args):
+        """
+        Count one failure. 'format_exemplar(*args)' describes it, and is
+        only called at flush time if the failure is sampled as an exemplar.
+        """
+        key = (endpoint, field, code)
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                entry = self._counts[key] = [0, []]
+            entry[0] += 1
+            if format_exemplar is not None:
+                exemplars = entry[1]
+                max_exemplars = self.max_exemplars
+                # Reservoir sampling keeps a uniform sample of the window.
+                if len(exemplars) < max_exemplars:
+                    exemplars.append((format_exemplar, args))
+                else:
+                    index = random.randrange(entry[0])
+                    if index < max_exemplars:
+                        exemplars[index] = (format_exemplar, args)
+            now = time.monotonic()
+            if self._next_flush is None:
+                self._next_flush = now + self.flush_interval
+            due = now >= self._next_flush
+            if not due and self._timer is None:
+                self._start_timer(self._next_flush - now)
+        if due:
+            self.flush()
+
+    def _start_timer(self, delay):
+        # Flush on schedule even if no further failures come in. Called
+        # with the lock held.
+        self._timer = threading.Timer(delay, self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('failed to flush validation failures')
+
+    def flush(self):
+        """
+        Report and reset the counts.
+        """
+        with self._lock:
+            counts = self._counts
+            self._counts = {}
+            self._next_flush = time.monotonic() + self.flush_interval
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not counts:
+            return
+        summaries = []
+        for ((endpoint, field, code), (count, exemplars)) in counts.items():
+            summaries.append({
+                'endpoint': endpoint,
+                'field': field,
+                'code': code,
+                'count': count,
+                'exemplars': [format_exemplar(*args)
+                              for (format_exemplar, args) in exemplars],
+            })
+        for sink in _sinks:
+            sink.report(summaries)
+
+
+class LoggingSink(object):
+    """
+    Logs one warning per (endpoint, field, code) and flush.
+    """
+
+    def report(self, summaries):
+        for summary in summaries:
+            logger.warning(
+                '%d validation failures in \'%s\' (%s: %s), e.g. %s',
+                summary['count'],
+                summary['endpoint'],
+                summary['field'],
+                summary['code'],
+                '; '.join(summary['exemplars']),
+            )
+
+
+def register_sink(sink):
+    """
+    Report failure summaries to 'sink', an object with a report(summaries)
+    method. Each summary is a dict with 'endpoint', 'field', 'code',
+    'count' and 'exemplars' (a list of strings).
+    """
+    _sinks.append(sink)
+
+
+def unregister_sink(sink):
+    _sinks.remove(sink)
+
+
+register_sink(LoggingSink())
+
+aggregator = FailureAggregator()
+atexit.register(aggregator.flush)
+
+
+def record(endpoint, field, code, format_exemplar=None, *args):
+    aggregator.record(endpoint, field, code, format_exemplar, *args)
@@ -0,0 +1,84 @@
+from django import forms
+from django.db import models
+from django.db.models.query import ModelIterable
+from django_api import model_serializers
+
+
+class FieldsetField(forms.CharField):
+    """
+    An accepts field for sparse fieldsets: a comma-separated list of the
+    model fields the client wants, such as '?fields=id,name'. Cleans to a
+    tuple of names, or None (all fields) when empty.
+
+    Only names in 'allowed' are accepted. Pass the cleaned value to the
+    response as 'fields' (see project()).
+    """
+    default_error_messages = {
+        'unknown': 'Unknown fields: %(names)s.',
+    }
+
+    def __init__(self, allowed, **kwargs):
+        kwargs.setdefault('required', False)
+        super(FieldsetField, self).__init__(**kwargs)
+        self.allowed = frozenset(allowed)
+
+    def to_python(self, value):
+        value = super(FieldsetField, self).to_python(value)
+        if value in self.empty_values:
+            return None
+        fields = []
+        for name in value.split(','):
+            name = name.strip()
+            if name and name not in fields:
+                fields.append(name)
+        unknown = [name for name in fields if name not in self.allowed]
+        if unknown:
+            raise forms.ValidationError(
+                self.error_messages['unknown'],
+                code='unknown',
+                params={'names': ', '.join(unknown)},
+            )
+        return tuple(fields) or None
+
+
+def project(data, fields):
+    """
+    Restrict the models and QuerySets in 'data' (and inside its dicts, lists
+    and tuples) to 'fields'.
+
+    Unevaluated QuerySets become values() QuerySets, so only the requested
+    columns are read from the database and encoded. Model instances and
+    evaluated QuerySets are serialized with only the requested fields.
+    Names that are not fields of a model (or are excluded by its registered
+    serializer) are ignored for that model.
+    """
+    if fields is None:
+        return data
+    if isinstance(data, models.query.QuerySet):
+        serializer = model_serializers.get_serializer(
+            data.model
+        ).restrict(fields)
+        if data._result_cache is not None:
+            return [serializer.serialize(obj)
+                    if isinstance(obj, models.Model) else obj
+                    for obj in data._result_cache]
+        if data._iterable_class is not ModelIterable:
+            return data
+        if not serializer.names:
+            # values() without names would read (and encode) every column,
+            # including excluded ones.
+            return [{} for _ in data.values_list('pk', flat=True)]
+        # values() names foreign keys by field name, with the related pk as
+        # the value, as the serializer does.
+        return data.values(*serializer.names)
+    elif isinstance(data, models.Model):
+        return model_serializers.get_serializer(
+            type(data)
+        ).restrict(fields).serialize(data)
+    elif isinstance(data, dict):
+        return dict(
+            (key, project(value, fields)) for (key, value) in data.items()
+        )
+    elif isinstance(data, (list, tuple)):
+        return [project(value, fields) for value in data]
+    return data
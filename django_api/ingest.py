@@ -0,0 +1,212 @@
+import codecs
+import json
+from django_api.json_backends import get_backend
+from django_api.negotiation import request_backend
+
+
+NDJSON_CONTENT_TYPES = (
+    'application/x-ndjson',
+    'application/ndjson',
+    'application/jsonl',
+    'application/x-jsonlines',
+)
+
+# Bytes read from the request body at a time.
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_ndjson(stream, max_record_size):
+    """
+    Yield the value on each non-blank line of 'stream', a file-like object
+    (such as a request), reading one line at a time.
+
+    Raises ValueError for invalid JSON, or a line over 'max_record_size'
+    bytes (if it is not None).
+    """
+    loads = get_backend().loads
+    limit = -1 if max_record_size is None else max_record_size + 1
+    line_number = 0
+    while True:
+        line = stream.readline(limit)
+        if not line:
+            return
+        line_number += 1
+        if len(line) == limit and not line.endswith(b'\n'):
+            raise ValueError('line %d is larger than %d bytes' %
+                             (line_number, max_record_size))
+        if line.strip():
+            try:
+                yield loads(line)
+            except ValueError as e:
+                raise ValueError('line %d: %s' % (line_number, e))
+
+
+class _TextBuffer(object):
+    """
+    Text decoded from a byte stream, read a chunk at a time.
+    """
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.position = 0
+        self.eof = False
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def fill(self):
+        """
+        Read another chunk, dropping the text before 'position'.
+        """
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.text = (self.text[self.position:] +
+                     self._utf8.decode(chunk, final=self.eof))
+        self.position = 0
+
+    def next_char(self):
+        """
+        Skip whitespace, and return the next character, or '' at the end.
+        """
+        while True:
+            text = self.text
+            while (self.position < len(text) and
+                   text[self.position] in _WHITESPACE):
+                self.position += 1
+            if self.position < len(text):
+                return text[self.position]
+            if self.eof:
+                return ''
+            self.fill()
+
+
+def _decode_item(decoder, buffer, index, max_record_size):
+    # raw_decode() doesn't skip leading whitespace.
+    buffer.next_char()
+    while True:
+        try:
+            (value, end) = decoder.raw_decode(buffer.text, buffer.position)
+            error = None
+        except ValueError as e:
+            (end, error) = (None, e)
+        # An item that runs to the end of the buffer may be incomplete (a
+        # number can continue in the next chunk), so read on until
+        # something follows it.
+        if end is not None and (end < len(buffer.text) or buffer.eof):
+            buffer.position = end
+            return value
+        if buffer.eof:
+            raise ValueError('item %d: %s' % (index, error))
+        if (max_record_size is not None and
+                len(buffer.text) - buffer.position > max_record_size):
+            raise ValueError('item %d is larger than %d characters' %
+                             (index, max_record_size))
+        buffer.fill()
+
+
+def iter_json_array(stream, max_record_size, chunk_size=CHUNK_SIZE):
+    """
+    Yield the items of the JSON array in 'stream', a file-like object (such
+    as a request), reading it 'chunk_size' bytes at a time, so that only
+    about one item is held in memory.
+
+    Raises ValueError for invalid JSON, or an item over 'max_record_size'
+    characters (if it is not None).
+    """
+    decoder = json.JSONDecoder()
+    buffer = _TextBuffer(stream, chunk_size)
+    if buffer.next_char() != '[':
+        raise ValueError('expected a JSON array')
+    buffer.position += 1
+    if buffer.next_char() == ']':
+        buffer.position += 1
+    else:
+        index = 0
+        while True:
+            yield _decode_item(decoder, buffer, index, max_record_size)
+            char = buffer.next_char()
+            buffer.position += 1
+            if char == ']':
+                break
+            if char != ',':
+                raise ValueError('expected \',\' or \']\' after item %d' %
+                                 index)
+            index += 1
+    if buffer.next_char():
+        raise ValueError('extra data after the JSON array')
+
+
+class RecordStream(object):
+    """
+    The validated records of a streamed request body, as passed to a
+    @validate_json_request(..., stream=True) view.
+
+    Iterating over it yields each record that 'schema' accepts, cleaned.
+    Rejected records are counted, and the errors of the first 'max_errors'
+    are kept for summary(). If the body itself is malformed, iteration stops
+    and 'error' describes the problem.
+    """
+
+    def __init__(self, items, schema, max_errors=100):
+        self._items = items
+        self.schema = schema
+        self.max_errors = max_errors
+        self.received = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+        self.error = None
+
+    def __iter__(self):
+        try:
+            for item in self._items:
+                index = self.received
+                self.received += 1
+                (cleaned, errors) = self.schema.clean(item)
+                if errors:
+                    self.rejected += 1
+                    if len(self.errors) < self.max_errors:
+                        self.errors.append({
+                            'index': index,
+                            'errors': dict(
+                                (path, list(messages))
+                                for (path, messages) in errors.items()
+                            ),
+                        })
+                    continue
+                self.accepted += 1
+                yield cleaned
+        except ValueError as e:
+            self.error = str(e)
+
+    def summary(self):
+        """
+        Return a dict summarizing the records read so far.
+        """
+        summary = {
+            'received': self.received,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'errors': self.errors,
+        }
+        if self.error is not None:
+            summary['error'] = self.error
+        return summary
+
+
+def read_records(request, schema, max_record_size, max_errors=100):
+    """
+    Return a RecordStream over the body of 'request': one JSON value per
+    line for NDJSON content types, the packed values of a binary format
+    (such as MessagePack), or the items of a JSON array otherwise.
+    """
+    backend = request_backend(request)
+    if backend is not None and backend.binary:
+        items = backend.iter_loads(request, max_record_size)
+    elif request.content_type in NDJSON_CONTENT_TYPES:
+        items = iter_ndjson(request, max_record_size)
+    else:
+        items = iter_json_array(request, max_record_size)
+    return RecordStream(items, schema, max_errors)
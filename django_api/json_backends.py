@@ -0,0 +1,268 @@
+import datetime
+import decimal
+import json
+import logging
+import uuid
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils.functional import Promise
+from django_api import model_serializers
+
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_model(obj):
+    return model_serializers.get_serializer(type(obj)).serialize(obj)
+
+
+def _encode_queryset(obj):
+    return model_serializers.get_serializer(obj.model).serialize_queryset(obj)
+
+
+_django_default = DjangoJSONEncoder().default
+
+# Type => conversion to a JSON-encodable value. Subclasses are matched
+# through their MRO, see encode_default().
+ENCODERS = {
+    models.Model: _encode_model,
+    models.query.QuerySet: _encode_queryset,
+    datetime.datetime: _django_default,
+    datetime.date: _django_default,
+    datetime.time: _django_default,
+    datetime.timedelta: _django_default,
+    decimal.Decimal: _django_default,
+    uuid.UUID: _django_default,
+    Promise: _django_default,
+}
+
+_resolved_encoders = {}
+
+
+def register_type(klass, func):
+    """
+    Encode instances of 'klass' (and its subclasses) as 'func(obj)'.
+    """
+    ENCODERS[klass] = func
+    _resolved_encoders.clear()
+
+
+def encode_default(obj):
+    """
+    Convert 'obj' to a JSON-encodable value using the ENCODERS table.
+
+    The conversion for each concrete type is looked up along its MRO once and
+    then cached.
+    """
+    klass = type(obj)
+    try:
+        func = _resolved_encoders[klass]
+    except KeyError:
+        func = None
+        for base in klass.__mro__:
+            if base in ENCODERS:
+                func = ENCODERS[base]
+                break
+        _resolved_encoders[klass] = func
+    if func is None:
+        raise TypeError('%r is not JSON serializable' % obj)
+    return func(obj)
+
+
+class JsonBackend(object):
+    """
+    The stdlib encoder (C-accelerated), sharing one encoder instance across
+    responses.
+    """
+    name = 'json'
+    content_type = 'application/json'
+    binary = False
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'),
+                                         default=encode_default)
+
+    def dumps(self, data):
+        return self._encoder.encode(data)
+
+    def loads(self, content):
+        return json.loads(content)
+
+
+class OrjsonBackend(JsonBackend):
+    """
+    orjson encoder. Produces the same values as JsonBackend, with these
+    differences in the output:
+
+    * non-ASCII characters are written as UTF-8 instead of escaped;
+    * floats may be written differently (1e16 rather than 1e+16);
+    * NaN and infinities are written as null, where the stdlib writes the
+      invalid JSON NaN and Infinity.
+
+    Data orjson can't encode, such as integers beyond 64 bits, is encoded
+    with JsonBackend instead.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        super(OrjsonBackend, self).__init__()
+        import orjson
+        self._dumps = orjson.dumps
+        self.loads = orjson.loads
+        # Dates go through encode_default so they are formatted like
+        # DjangoJSONEncoder does.
+        self._options = (orjson.OPT_PASSTHROUGH_DATETIME |
+                         orjson.OPT_NON_STR_KEYS)
+
+    def dumps(self, data):
+        try:
+            return self._dumps(data, default=encode_default,
+                               option=self._options)
+        except TypeError:
+            # orjson.JSONEncodeError, for example for an integer that
+            # doesn't fit in 64 bits.
+            return super(OrjsonBackend, self).dumps(data)
+
+
+class _CountingReader(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class MsgpackBackend(object):
+    """
+    MessagePack encoder, for clients that ask for it (see negotiation).
+    Values are converted with encode_default as for JSON, so dates and
+    Decimals are strings, and tuples are arrays.
+    """
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+        self._errors = (ValueError, msgpack.UnpackException)
+
+    def dumps(self, data):
+        return self._msgpack.packb(data, default=encode_default,
+                                   use_bin_type=True)
+
+    def loads(self, content):
+        try:
+            return self._msgpack.unpackb(content, raw=False,
+                                         strict_map_key=False)
+        except self._errors as e:
+            raise ValueError(str(e) or e.__class__.__name__)
+
+    def iter_loads(self, stream, max_record_size, chunk_size=64 * 1024):
+        """
+        Yield the values packed one after another in 'stream', a file-like
+        object, reading it 'chunk_size' bytes at a time.
+
+        Raises ValueError for invalid data, or a value over
+        'max_record_size' bytes (if it is not None).
+        """
+        if max_record_size is not None:
+            chunk_size = min(chunk_size, max_record_size)
+        reader = _CountingReader(stream)
+        unpacker = self._msgpack.Unpacker(
+            reader, raw=False, strict_map_key=False, read_size=chunk_size,
+            max_buffer_size=max_record_size or 0,
+        )
+        index = 0
+        while True:
+            try:
+                value = next(unpacker)
+            except StopIteration:
+                # The unpacker stops quietly on a truncated value.
+                if unpacker.tell() < reader.count:
+                    raise ValueError('item %d is incomplete' % index)
+                return
+            except self._msgpack.BufferFull:
+                raise ValueError('item %d is larger than %d bytes' %
+                                 (index, max_record_size))
+            except self._errors as e:
+                raise ValueError('item %d: %s' % (index, e))
+            yield value
+            index += 1
+
+
+BACKENDS = {
+    'json': JsonBackend,
+    'orjson': OrjsonBackend,
+}
+
+_backends = {}
+
+
+def get_backend():
+    """
+    Return the backend selected by the DJANGO_API_JSON_BACKEND setting
+    ('json' or 'orjson'; defaults to 'json').
+
+    If the selected backend's package is not installed, the stdlib backend is
+    used instead.
+    """
+    name = getattr(settings, 'DJANGO_API_JSON_BACKEND', 'json')
+    try:
+        return _backends[name]
+    except KeyError:
+        pass
+    if name not in BACKENDS:
+        raise ImproperlyConfigured(
+            'Unknown DJANGO_API_JSON_BACKEND \'%s\'' % name
+        )
+    try:
+        backend = BACKENDS[name]()
+    except ImportError:
+        logger.warn(
+            'JSON backend \'%s\' is not installed, using \'json\'', name
+        )
+        backend = JsonBackend()
+    _backends[name] = backend
+    return backend
+
+
+# Binary formats offered through content negotiation, by name and media type.
+BINARY_BACKENDS = {
+    'msgpack': MsgpackBackend,
+}
+
+BINARY_MEDIA_TYPES = {
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+}
+
+_binary_backends = {}
+
+
+def get_binary_backend(media_type):
+    """
+    Return the backend for 'media_type' if it is a binary format enabled by
+    the DJANGO_API_BINARY_FORMATS setting (defaults to ['msgpack']) and its
+    package is installed, or None.
+    """
+    name = BINARY_MEDIA_TYPES.get(media_type)
+    if name not in getattr(settings, 'DJANGO_API_BINARY_FORMATS',
+                           ['msgpack']):
+        return None
+    try:
+        return _binary_backends[name]
+    except KeyError:
+        pass
+    try:
+        backend = BINARY_BACKENDS[name]()
+    except ImportError:
+        backend = None
+    _binary_backends[name] = backend
+    return backend
@@ -1,7 +1,14 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core import serializers
 from django.db import models
-from django.forms.models import model_to_dict
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
+from django_api import model_serializers
+from django_api import timing
+from django_api.fieldsets import project
+from django_api.json_backends import encode_default
+from django_api.negotiation import response_backend
 
 
 class JsonResponseEncoder(serializers.json.DjangoJSONEncoder):
@@ -10,27 +17,177 @@ class JsonResponseEncoder(serializers.json.DjangoJSONEncoder):
     """
     def default(self, obj):
         """
-        Convert QuerySet objects to their list counter-parts
+        Convert Django types using the json_backends.ENCODERS table.
         """
-        if isinstance(obj, models.Model):
-            return self.encode(model_to_dict(obj))
-        elif isinstance(obj, models.query.QuerySet):
-            return serializers.serialize('json', obj)
-        else:
-            return super(JsonResponseEncoder, self).default(obj)
+        return encode_default(obj)
 
 
 class JsonResponse(HttpResponse):
-    def __init__(self, data={}):
+    """
+    JSON response for 'data'. With 'fields' (a tuple of names, such as the
+    cleaned value of a FieldsetField), models and QuerySets in 'data' are
+    restricted to those fields; see fieldsets.project().
+
+    Inside a negotiated request, 'data' is encoded in the binary format the
+    client asked for instead, such as MessagePack; see negotiation.
+    """
+    def __init__(self, data={}, fields=None):
         super(JsonResponse, self).__init__(content_type='application/json')
+        if fields is not None:
+            data = project(data, fields)
         self.set_content(data)
 
     def set_content(self, data):
-        json_encoder = JsonResponseEncoder(separators=(',', ':'))
-        content = json_encoder.encode(data)
+        backend = response_backend()
+        with timing.phase('encode'):
+            self.content = backend.dumps(data)
+        if backend.binary:
+            self['Content-Type'] = backend.content_type
+
+
+class EncodedJsonResponse(JsonResponse):
+    """
+    JsonResponse for content that is already encoded JSON, such as a cached
+    response, or in another format given by 'content_type'.
+    """
+    def __init__(self, content, status=200, content_type=None):
+        self.status_code = status
+        super(EncodedJsonResponse, self).__init__(content)
+        if content_type is not None:
+            self['Content-Type'] = content_type
+
+    def set_content(self, content):
         self.content = content
 
 
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    JSON response that is encoded while it is being sent.
+
+    QuerySets anywhere in 'data' (inside dicts, lists and tuples) are read
+    with QuerySet.iterator() in batches of 'chunk_size' rows and written as a
+    JSON array of objects, so large listings are never held in memory as a
+    whole. Output is buffered into chunks of about
+    'buffer_size' bytes.
+
+    With 'fields', models and QuerySets are restricted to those fields, as
+    in JsonResponse. Streamed responses are always JSON.
+    """
+    chunk_size = 2000
+    buffer_size = 64 * 1024
+
+    def __init__(self, data={}, chunk_size=None, fields=None):
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if fields is not None:
+            data = project(data, fields)
+        super(StreamingJsonResponse, self).__init__(
+            self.iter_content(data), content_type='application/json'
+        )
+
+    def iter_content(self, data):
+        json_encoder = JsonResponseEncoder(separators=(',', ':'))
+        buffer = []
+        buffered = 0
+        for piece in self._iter_encode(json_encoder, data):
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= self.buffer_size:
+                yield ''.join(buffer)
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield ''.join(buffer)
+
+    def _iter_encode(self, json_encoder, obj):
+        if isinstance(obj, models.query.QuerySet):
+            for piece in self._iter_queryset(json_encoder, obj):
+                yield piece
+        elif isinstance(obj, dict):
+            yield '{'
+            for (i, (key, value)) in enumerate(obj.items()):
+                # Let the encoder coerce the key exactly as it would inside
+                # a dict, then strip the surrounding '{' and ':null}'.
+                key_json = json_encoder.encode({key: None})[1:-6]
+                yield (',' if i else '') + key_json + ':'
+                for piece in self._iter_encode(json_encoder, value):
+                    yield piece
+            yield '}'
+        elif isinstance(obj, (list, tuple)):
+            yield '['
+            for (i, value) in enumerate(obj):
+                if i:
+                    yield ','
+                for piece in self._iter_encode(json_encoder, value):
+                    yield piece
+            yield ']'
+        else:
+            yield json_encoder.encode(obj)
+
+    def _iter_queryset(self, json_encoder, queryset):
+        serializer = model_serializers.get_serializer(queryset.model)
+        rows = serializer.iter_queryset(queryset, chunk_size=self.chunk_size)
+        yield '['
+        for (i, row) in enumerate(rows):
+            yield (',' if i else '') + json_encoder.encode(row)
+        yield ']'
+
+
+def _encode_cost(data, limit):
+    """
+    Estimate the cost of encoding 'data' as a number of values, stopping
+    once 'limit' is reached. QuerySets count as 'limit', since they have to
+    be evaluated too.
+    """
+    cost = 0
+    pending = [data]
+    while pending and cost < limit:
+        obj = pending.pop()
+        cost += 1
+        if isinstance(obj, models.query.QuerySet):
+            return limit
+        elif isinstance(obj, dict):
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+    return cost
+
+
+def _contains_queryset(data):
+    pending = [data]
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, models.query.QuerySet):
+            return True
+        elif isinstance(obj, dict):
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+    return False
+
+
+async def ajson_response(data={}, response_class=JsonResponse):
+    """
+    Build 'response_class(data)' from an async view.
+
+    Payloads with more than DJANGO_API_ASYNC_ENCODE_THRESHOLD values (default
+    1000), or with QuerySets (which can't be evaluated on the event loop), are
+    encoded in a worker thread so the event loop stays free.
+
+    For example:
+
+    async def course_list(request):
+        return await ajson_response({'courses': Course.objects.all()})
+    """
+    limit = getattr(settings, 'DJANGO_API_ASYNC_ENCODE_THRESHOLD', 1000)
+    if _encode_cost(data, limit) < limit:
+        return response_class(data)
+    # ORM access has to run in the thread Django uses for sync code.
+    return await sync_to_async(
+        response_class, thread_sensitive=_contains_queryset(data)
+    )(data)
+
+
 class JsonResponseCreated(JsonResponse):
     status_code = 201
 
@@ -80,3 +237,15 @@ class JsonResponseNotFound(JsonResponseWithStatus):
 
 class JsonResponseNotSupported(JsonResponseWithStatus):
     status_code = 400
+
+
+class JsonResponseTooLarge(JsonResponseWithStatus):
+    status_code = 413
+
+
+class JsonResponseTooManyRequests(JsonResponseWithStatus):
+    status_code = 429
+
+
+class JsonResponseServiceUnavailable(JsonResponseWithStatus):
+    status_code = 503
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test.utils import setup_databases
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_databases
+from django.test.utils import teardown_test_environment
+from django_api import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the django_api decorators and JSON responses against a '
+        'test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default=','.join(
+                str(size) for size in benchmarks.DEFAULT_SIZES
+            ),
+            help='Comma-separated QuerySet sizes to encode.',
+        )
+        parser.add_argument(
+            '--min-time', type=float, default=0.5,
+            help='Minimum seconds to run each benchmark for.',
+        )
+        parser.add_argument(
+            '--filter', default='',
+            help='Only run benchmarks whose name contains this string.',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Fail if throughput regressed against this baseline file.',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed throughput drop against the baseline, as a '
+                 'fraction (default 0.2).',
+        )
+        parser.add_argument(
+            '--save-baseline',
+            help='Save the results to this baseline file.',
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = benchmarks.run(
+                [benchmark for benchmark in benchmarks.get_benchmarks(sizes)
+                 if options['filter'] in benchmark.name],
+                min_time=options['min_time'],
+                stdout=self.stdout,
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options['save_baseline']:
+            benchmarks.save_baseline(options['save_baseline'], results)
+
+        if options['baseline']:
+            regressions = benchmarks.compare(
+                results,
+                benchmarks.load_baseline(options['baseline']),
+                options['threshold'],
+            )
+            if regressions:
+                raise CommandError('Performance regressions:\n%s' % '\n'.join(
+                    '  %s: %.1f ops/s, baseline %.1f ops/s' % (
+                        name, current, expected
+                    )
+                    for (name, expected, current) in regressions
+                ))
@@ -0,0 +1,33 @@
+from django.utils.deprecation import MiddlewareMixin
+from django_api.compression import compress_response
+from django_api.negotiation import negotiate
+from django_api.negotiation import vary
+
+
+class JsonCompressionMiddleware(MiddlewareMixin):
+    """
+    Compress JsonResponse and StreamingJsonResponse bodies with gzip or
+    brotli, negotiated from the request's Accept-Encoding header.
+
+    Unlike GZipMiddleware, other responses and JSON responses below the
+    DJANGO_API_COMPRESS_MIN_SIZE setting are not compressed.
+    """
+
+    def process_response(self, request, response):
+        return compress_response(request, response)
+
+
+class NegotiationMiddleware(object):
+    """
+    Encode the JsonResponses of every view in the binary format (such as
+    MessagePack) that the request's Accept header prefers; see
+    django_api.negotiation. @api views negotiate without it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with negotiate(request):
+            response = self.get_response(request)
+        return vary(response)
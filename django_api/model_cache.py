@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from django.core.cache import caches
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+
+_registry = {}
+
+
+class ModelCache(object):
+    """
+    Django-cache-backed store of model instances keyed by primary key, used
+    by api_accepts to resolve hot model fields without a database query.
+
+    Entries expire after 'timeout' seconds, and each process keeps at most
+    'max_entries' keys per model, evicting the least recently used one.
+    Saving or deleting an instance invalidates its entry.
+    """
+
+    def __init__(self, model, timeout=300, max_entries=1000,
+                 cache_alias='default'):
+        self.model = model
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.cache_alias = cache_alias
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def make_key(self, pk):
+        return 'django_api:model:%s.%s:%s' % (
+            self.model._meta.app_label, self.model._meta.model_name, pk
+        )
+
+    def get_many(self, pks):
+        """
+        Return a dict of pk => instance for the pks that are cached.
+        """
+        keys = dict((self.make_key(pk), pk) for pk in pks)
+        return self._record_hits(keys, self.cache.get_many(list(keys)))
+
+    async def aget_many(self, pks):
+        keys = dict((self.make_key(pk), pk) for pk in pks)
+        return self._record_hits(keys, await self.cache.aget_many(list(keys)))
+
+    def set_many(self, objects):
+        """
+        Cache a dict of pk => instance, evicting least recently used entries
+        beyond 'max_entries'.
+        """
+        if not objects:
+            return
+        self.cache.set_many(self._make_entries(objects), self.timeout)
+        evicted = self._record_keys(objects)
+        if evicted:
+            self.cache.delete_many(evicted)
+
+    async def aset_many(self, objects):
+        if not objects:
+            return
+        await self.cache.aset_many(self._make_entries(objects), self.timeout)
+        evicted = self._record_keys(objects)
+        if evicted:
+            await self.cache.adelete_many(evicted)
+
+    def _record_hits(self, keys, found):
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            for key in found:
+                if key in self._keys:
+                    self._keys.move_to_end(key)
+        return dict((keys[key], obj) for (key, obj) in found.items())
+
+    def _make_entries(self, objects):
+        return dict((self.make_key(pk), obj) for (pk, obj) in objects.items())
+
+    def _record_keys(self, objects):
+        """
+        Track the keys of newly cached 'objects', and return the least
+        recently used keys that should be evicted.
+        """
+        evicted = []
+        with self._lock:
+            for pk in objects:
+                key = self.make_key(pk)
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.max_entries:
+                evicted.append(self._keys.popitem(last=False)[0])
+        return evicted
+
+    def invalidate(self, pk):
+        key = self.make_key(pk)
+        with self._lock:
+            self._keys.pop(key, None)
+        self.cache.delete(key)
+
+    def _invalidate_instance(self, sender, instance, **kwargs):
+        self.invalidate(instance.pk)
+
+
+def register(model, timeout=300, max_entries=1000, cache_alias='default'):
+    """
+    Opt 'model' in to cached lookups in api_accepts.
+
+    For example, in your app's AppConfig.ready():
+
+        model_cache.register(Course, timeout=600, max_entries=500)
+    """
+    unregister(model)
+    model_cache = ModelCache(model, timeout, max_entries, cache_alias)
+    post_save.connect(model_cache._invalidate_instance, sender=model,
+                      weak=False, dispatch_uid='django_api_model_cache')
+    post_delete.connect(model_cache._invalidate_instance, sender=model,
+                        weak=False, dispatch_uid='django_api_model_cache')
+    _registry[model] = model_cache
+    return model_cache
+
+
+def unregister(model):
+    if model in _registry:
+        post_save.disconnect(sender=model,
+                             dispatch_uid='django_api_model_cache')
+        post_delete.disconnect(sender=model,
+                               dispatch_uid='django_api_model_cache')
+        del _registry[model]
+
+
+def get_model_cache(model):
+    """
+    Return the ModelCache registered for 'model', or None.
+    """
+    return _registry.get(model)
+
+
+def stats():
+    """
+    Return hit and miss counters for every registered model, keyed by
+    '<app_label>.<model_name>'.
+    """
+    return dict(
+        ('%s.%s' % (model._meta.app_label, model._meta.model_name), {
+            'hits': model_cache.hits,
+            'misses': model_cache.misses,
+        })
+        for (model, model_cache) in _registry.items()
+    )
@@ -0,0 +1,166 @@
+import copy
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models.query import ModelIterable
+
+
+_registry = {}
+
+# Restricted serializers cached per serializer; see ModelSerializer.restrict.
+MAX_RESTRICTED = 128
+
+_django_default = DjangoJSONEncoder().default
+
+# Field types whose values are converted up front, so encoded rows only
+# contain JSON primitives.
+CONVERTED_FIELD_TYPES = (
+    models.DateField,  # Includes DateTimeField.
+    models.TimeField,
+    models.DurationField,
+    models.DecimalField,
+    models.UUIDField,
+)
+
+
+def _convert(value):
+    if value is None:
+        return None
+    return _django_default(value)
+
+
+class ModelSerializer(object):
+    """
+    Serializes instances of one model class to dicts of JSON-ready values.
+
+    The field-accessor plan (field name, attribute name and value conversion)
+    is compiled once per model. Foreign keys are written as the related
+    object's primary key. By default, the plan holds the same fields as
+    model_to_dict(), except many-to-many fields, which would cost a query per
+    instance.
+    """
+
+    def __init__(self, model, fields=None, exclude=None):
+        self.model = model
+        self.plan = []
+        for field in model._meta.concrete_fields:
+            if not getattr(field, 'editable', False):
+                continue
+            if fields is not None and field.name not in fields:
+                continue
+            if exclude and field.name in exclude:
+                continue
+            if isinstance(field, CONVERTED_FIELD_TYPES):
+                converter = _convert
+            else:
+                converter = None
+            self.plan.append((field.name, field.attname, converter))
+        self.attnames = [attname for (name, attname, converter) in self.plan]
+        self.names = [name for (name, attname, converter) in self.plan]
+        self._restricted = {}
+
+    def restrict(self, fields):
+        """
+        Return a serializer for the subset of this one's fields named in
+        'fields', in this serializer's order.
+
+        Restricted serializers are cached by the fields they keep, so the
+        order of 'fields' and names that aren't fields of the model don't
+        add entries, and at most MAX_RESTRICTED are kept per serializer.
+        """
+        key = tuple(name for name in self.names if name in fields)
+        try:
+            return self._restricted[key]
+        except KeyError:
+            pass
+        serializer = copy.copy(self)
+        serializer.plan = [entry for entry in self.plan if entry[0] in key]
+        serializer.attnames = [attname for (name, attname, converter)
+                               in serializer.plan]
+        serializer.names = [name for (name, attname, converter)
+                            in serializer.plan]
+        serializer._restricted = {}
+        if len(self._restricted) < MAX_RESTRICTED:
+            self._restricted[key] = serializer
+        return serializer
+
+    def serialize(self, obj):
+        """
+        Return a dict for the model instance 'obj'. Deferred fields are left
+        out rather than loaded.
+        """
+        deferred = obj.get_deferred_fields()
+        data = {}
+        for (name, attname, converter) in self.plan:
+            if attname in deferred:
+                continue
+            value = getattr(obj, attname)
+            data[name] = converter(value) if converter else value
+        return data
+
+    def serialize_row(self, row):
+        """
+        Return a dict for 'row', a dict from QuerySet.values(*self.attnames).
+        """
+        data = {}
+        for (name, attname, converter) in self.plan:
+            value = row[attname]
+            data[name] = converter(value) if converter else value
+        return data
+
+    def iter_queryset(self, queryset, chunk_size=None):
+        """
+        Yield a dict for each object in 'queryset'.
+
+        Plain model querysets are read with values(), without building model
+        instances. Querysets that already return dicts or tuples (from
+        values() or values_list()) are passed through, and querysets that
+        were already evaluated are serialized from their cached results.
+        """
+        if queryset._result_cache is not None:
+            for obj in queryset._result_cache:
+                yield (self.serialize(obj) if isinstance(obj, models.Model)
+                       else obj)
+            return
+        if queryset._iterable_class is not ModelIterable:
+            rows = queryset if chunk_size is None else queryset.iterator(
+                chunk_size=chunk_size
+            )
+            for row in rows:
+                yield row
+            return
+        if not self.attnames:
+            # values() without names would read every column.
+            for _ in queryset.values_list('pk', flat=True):
+                yield {}
+            return
+        rows = queryset.values(*self.attnames)
+        if chunk_size is not None:
+            rows = rows.iterator(chunk_size=chunk_size)
+        for row in rows:
+            yield self.serialize_row(row)
+
+    def serialize_queryset(self, queryset):
+        return list(self.iter_queryset(queryset))
+
+
+def register(model, fields=None, exclude=None, serializer_class=None):
+    """
+    Customize how 'model' is serialized in JSON responses. For example, to
+    keep password hashes out of responses:
+
+        model_serializers.register(User, exclude=['password'])
+    """
+    serializer_class = serializer_class or ModelSerializer
+    _registry[model] = serializer_class(model, fields=fields, exclude=exclude)
+    return _registry[model]
+
+
+def get_serializer(model):
+    """
+    Return the serializer for 'model', compiling it on first use.
+    """
+    try:
+        return _registry[model]
+    except KeyError:
+        _registry[model] = ModelSerializer(model)
+        return _registry[model]
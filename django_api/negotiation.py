@@ -0,0 +1,118 @@
+"""
+Content negotiation of compact binary encodings for JSON responses.
+
+Requests to @api and @validate_json_request views (or to any view, with
+middleware.NegotiationMiddleware) that accept a binary format enabled by the
+DJANGO_API_BINARY_FORMATS setting, such as "Accept: application/msgpack",
+get JsonResponse bodies encoded in that format instead of JSON, from the
+same data and with the same conversions (json_backends.ENCODERS).
+"""
+from contextvars import ContextVar
+from django.conf import settings
+from django.http import HttpResponseBase
+from django.utils.cache import patch_vary_headers
+from django_api.json_backends import BINARY_MEDIA_TYPES
+from django_api.json_backends import get_backend
+from django_api.json_backends import get_binary_backend
+
+
+_current_backend = ContextVar('django_api_response_backend', default=None)
+
+_JSON_MEDIA_RANGES = ('application/json', 'application/*', '*/*')
+
+
+def parse_quality_values(header):
+    """
+    Return {name: quality} for an Accept or Accept-Encoding header, with
+    names lowercased.
+    """
+    qualities = {}
+    for item in header.split(','):
+        params = item.strip().split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            (key, _, value) = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+def select_backend(accept):
+    """
+    Return the binary backend that an Accept header prefers at least as
+    much as JSON, or None for JSON. Binary formats are only selected when
+    they are named explicitly, not through wildcards.
+    """
+    qualities = parse_quality_values(accept)
+    json_quality = 0.0
+    for media_range in _JSON_MEDIA_RANGES:
+        if media_range in qualities:
+            json_quality = qualities[media_range]
+            break
+    best = None
+    for (media_type, quality) in qualities.items():
+        if quality <= 0 or quality < json_quality:
+            continue
+        backend = get_binary_backend(media_type)
+        if backend is not None and (best is None or quality > best[0]):
+            best = (quality, backend)
+    return best[1] if best else None
+
+
+def response_backend():
+    """
+    Return the backend that encodes JsonResponses in the current request.
+    """
+    return _current_backend.get() or get_backend()
+
+
+def request_backend(request):
+    """
+    Return the backend that decodes the body of 'request', from its
+    Content-Type, or None if it is a binary format that is not enabled.
+    """
+    backend = get_binary_backend(request.content_type)
+    if backend is None and request.content_type in BINARY_MEDIA_TYPES:
+        return None
+    return backend or get_backend()
+
+
+class negotiate(object):
+    """
+    Context manager that encodes the JsonResponses built inside it in the
+    format that 'request' accepts:
+
+    with negotiation.negotiate(request):
+        response = view(request)
+    """
+    __slots__ = ('backend', 'token')
+
+    def __init__(self, request):
+        self.backend = select_backend(request.META.get('HTTP_ACCEPT', ''))
+
+    def __enter__(self):
+        self.token = _current_backend.set(self.backend)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_backend.reset(self.token)
+
+
+def vary(response):
+    """
+    Add Accept to the Vary header of 'response', whose encoding depends on
+    it, and return the response.
+    """
+    if not getattr(settings, 'DJANGO_API_BINARY_FORMATS', ['msgpack']):
+        return response
+    if isinstance(response, HttpResponseBase) and not response.streaming:
+        patch_vary_headers(response, ('Accept',))
+    return response
+
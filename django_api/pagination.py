@@ -0,0 +1,256 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+from django import forms
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django_api import model_serializers
+from django_api.json_helpers import JsonResponse
+
+
+class Cursor(object):
+    """
+    A position in a keyset-paginated listing: the ordering values of a row,
+    and whether the page starts 'after' or ends 'before' it.
+    """
+
+    def __init__(self, values, before=False):
+        self.values = list(values)
+        self.before = before
+
+    def encode(self):
+        content = json.dumps([int(self.before), self.values],
+                             separators=(',', ':'))
+        return base64.urlsafe_b64encode(
+            content.encode('utf-8')
+        ).rstrip(b'=').decode('ascii')
+
+    @classmethod
+    def decode(cls, token):
+        """
+        Return the Cursor encoded in 'token', or raise ValueError.
+        """
+        try:
+            content = base64.urlsafe_b64decode(
+                token + '=' * (-len(token) % 4)
+            )
+            (before, values) = json.loads(content)
+        except (binascii.Error, TypeError, ValueError):
+            raise ValueError('invalid cursor')
+        if not isinstance(values, list):
+            raise ValueError('invalid cursor')
+        return cls(values, bool(before))
+
+
+class CursorField(forms.CharField):
+    """
+    An accepts field for the opaque 'next'/'prev' cursors returned by
+    PaginatedJsonResponse. Cleans to a Cursor, or None for the first page.
+    """
+    default_error_messages = {
+        'invalid': 'Invalid cursor.',
+    }
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('required', False)
+        super(CursorField, self).__init__(**kwargs)
+
+    def to_python(self, value):
+        value = super(CursorField, self).to_python(value)
+        if value in self.empty_values:
+            return None
+        try:
+            return Cursor.decode(value)
+        except ValueError:
+            raise forms.ValidationError(self.error_messages['invalid'],
+                                        code='invalid')
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        # Full precision: DjangoJSONEncoder truncates to milliseconds, which
+        # would make pages skip or repeat rows.
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def get_keyset(queryset, ordering=None):
+    """
+    Return the [(attname, descending)] keyset for 'queryset', from
+    'ordering', the queryset's order_by(), or the model's default ordering.
+    The primary key is appended so that the keyset is unique.
+    """
+    opts = queryset.model._meta
+    if ordering is None:
+        ordering = queryset.query.order_by or opts.ordering or ['pk']
+    keyset = []
+    for name in ordering:
+        if not isinstance(name, str) or name == '?':
+            raise ImproperlyConfigured(
+                'keyset pagination needs field names, not %r' % (name,)
+            )
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name == 'pk':
+            field = opts.pk
+        else:
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not field.concrete:
+                raise ImproperlyConfigured(
+                    'cannot paginate %s on \'%s\'' % (opts.label, name)
+                )
+        keyset.append((field.attname, descending))
+    if opts.pk.attname not in [attname for (attname, _) in keyset]:
+        keyset.append((opts.pk.attname, keyset[-1][1] if keyset else False))
+    return keyset
+
+
+def _cursor_values(model, keyset, cursor):
+    """
+    Return the values of 'cursor' converted to the types of the keyset
+    columns, or raise ValueError if they don't fit (a tampered or stale
+    cursor).
+    """
+    if len(cursor.values) != len(keyset):
+        raise ValueError('cursor does not match the ordering')
+    opts = model._meta
+    values = []
+    for ((attname, _), value) in zip(keyset, cursor.values):
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError('cursor does not match the ordering')
+        try:
+            values.append(opts.get_field(attname).to_python(value))
+        except (TypeError, ValueError, ValidationError):
+            raise ValueError('cursor does not match the ordering')
+    return values
+
+
+def _keyset_filter(keyset, values, before):
+    """
+    Return a Q matching the rows after (or before) 'values' in 'keyset'
+    order: (a > x) | (a = x & b > y) | ...
+    """
+    condition = Q()
+    equal = {}
+    for ((attname, descending), value) in zip(keyset, values):
+        lookup = 'lt' if descending != before else 'gt'
+        condition |= Q(**dict(equal, **{'%s__%s' % (attname, lookup): value}))
+        equal[attname] = value
+    return condition
+
+
+def _row_values(keyset, row):
+    if isinstance(row, dict):
+        return [_cursor_value(row[attname]) for (attname, _) in keyset]
+    return [_cursor_value(getattr(row, attname)) for (attname, _) in keyset]
+
+
+def paginate(queryset, cursor=None, page_size=None, ordering=None,
+             fields=None):
+    """
+    Return (rows, next cursor, prev cursor) for the page of 'queryset' at
+    'cursor', with one range query on the ordering columns.
+
+    With 'fields', only those columns (and the ordering columns) are read,
+    and rows are returned as dicts of the requested fields.
+
+    Raises ValueError if the cursor does not match the ordering, or its
+    values don't fit the ordering columns.
+    """
+    if page_size is None:
+        page_size = getattr(settings, 'DJANGO_API_PAGE_SIZE', 50)
+    keyset = get_keyset(queryset, ordering)
+    before = cursor is not None and cursor.before
+
+    order_by = []
+    for (attname, descending) in keyset:
+        order_by.append('-' + attname if descending != before else attname)
+    queryset = queryset.order_by(*order_by)
+    if cursor is not None:
+        values = _cursor_values(queryset.model, keyset, cursor)
+        queryset = queryset.filter(_keyset_filter(keyset, values, before))
+
+    serializer = None
+    if fields is not None:
+        serializer = model_serializers.get_serializer(
+            queryset.model
+        ).restrict(fields)
+        attnames = set(attname for (attname, _) in keyset)
+        queryset = queryset.only(*(serializer.names + [
+            field.name for field in queryset.model._meta.concrete_fields
+            if field.attname in attnames
+        ]))
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+    if not rows:
+        return (rows, None, None)
+
+    first = Cursor(_row_values(keyset, rows[0]), before=True)
+    last = Cursor(_row_values(keyset, rows[-1]))
+    if serializer is not None:
+        rows = [serializer.serialize(row) for row in rows]
+    if before:
+        return (rows, last, first if has_more else None)
+    return (rows, last if has_more else None,
+            first if cursor is not None else None)
+
+
+class PaginatedJsonResponse(JsonResponse):
+    """
+    JSON response for one keyset-paginated page of a QuerySet:
+
+    {"results": [...], "next": "<cursor>", "prev": "<cursor>"}
+
+    'cursor' is the cleaned value of a CursorField (None for the first page).
+    Rows are ordered by 'ordering' (default: the QuerySet's ordering), with
+    the primary key as a tie-breaker; each page is one indexed range query
+    on those columns, however deep it is. 'next' and 'prev' are null at
+    either end of the listing. 'fields' restricts the rows to those fields,
+    as in JsonResponse. A cursor that doesn't fit the ordering (tampered
+    with, or from another listing) gets a 400 response. For example:
+
+    @api({
+        'accepts': {
+            'cursor': CursorField(),
+        },
+        ...
+    })
+    def list_courses(request):
+        return PaginatedJsonResponse(Course.objects.all(),
+                                     request.GET['cursor'],
+                                     ordering=['-created'])
+    """
+
+    def __init__(self, queryset, cursor=None, page_size=None, ordering=None,
+                 fields=None):
+        try:
+            (rows, next_cursor, prev_cursor) = paginate(
+                queryset, cursor, page_size, ordering, fields
+            )
+        except ValueError as e:
+            # The cursor came from the client, so this is a bad request.
+            self.status_code = 400
+            super(PaginatedJsonResponse, self).__init__(
+                'invalid cursor: %s' % e
+            )
+            return
+        super(PaginatedJsonResponse, self).__init__({
+            'results': rows,
+            'next': next_cursor.encode() if next_cursor else None,
+            'prev': prev_cursor.encode() if prev_cursor else None,
+        })
@@ -0,0 +1,184 @@
+"""
+Query budgets for @api and @api_returns views ('max_queries' and
+'max_db_time').
+
+A QueryCounter counts the queries a request runs, and the time spent in
+them, through a database execute wrapper. QueryBudget checks the counts:
+over budget is a 400 in DEBUG mode, and a counted failure in production
+(see django_api.failures).
+"""
+from contextvars import ContextVar
+from time import perf_counter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django_api import failures
+from django_api.json_helpers import JsonResponseBadRequest
+
+
+_active_counters = ContextVar('django_api_query_counters', default=())
+
+
+def _count_queries(execute, sql, params, many, context):
+    counters = _active_counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = perf_counter() - started
+        for counter in counters:
+            counter.queries += 1
+            counter.time += elapsed
+
+
+def install_wrapper():
+    """
+    Add the query counting wrapper to the database connections of the
+    current thread, once. It only counts while a QueryCounter is active in
+    the context that runs the query.
+    """
+    for connection in connections.all():
+        if _count_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_count_queries)
+
+
+class QueryCounter(object):
+    """
+    Context manager that counts the queries run in the current context on
+    every database connection of the current thread, and the time spent in
+    them.
+
+    The counter is found through a ContextVar, so queries that other
+    requests run on a shared connection (async requests share the thread
+    that runs sync code) are not counted.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self._tokens = []
+
+    def __enter__(self):
+        install_wrapper()
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deactivate()
+
+    def activate(self):
+        """
+        Count the queries run in the current context from now on, on the
+        connections where install_wrapper() ran.
+        """
+        self._tokens.append(
+            _active_counters.set(_active_counters.get() + (self,))
+        )
+
+    def deactivate(self):
+        _active_counters.reset(self._tokens.pop())
+
+    def iter_counted(self, content, on_done):
+        """
+        Yield from 'content' while counting the queries each step runs, and
+        call 'on_done()' at the end.
+        """
+        iterator = iter(content)
+        while True:
+            with self:
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+            yield chunk
+        on_done()
+
+
+def _format_breach(count, limit, unit):
+    return 'ran %s%s, over the budget of %s%s' % (count, unit, limit, unit)
+
+
+class QueryBudget(object):
+    """
+    The most queries ('max_queries') and database time ('max_db_time', in
+    seconds) an endpoint may use per request, including the queries run
+    while its response is encoded.
+    """
+
+    def __init__(self, max_queries=None, max_db_time=None):
+        self.max_queries = max_queries
+        self.max_db_time = max_db_time
+
+    def breaches(self, counter):
+        """
+        Return a list of (code, count, limit, unit) for each limit that
+        'counter' exceeds.
+        """
+        breaches = []
+        if self.max_queries is not None and counter.queries > self.max_queries:
+            breaches.append(
+                ('max_queries', counter.queries, self.max_queries, ' queries')
+            )
+        if self.max_db_time is not None and counter.time > self.max_db_time:
+            breaches.append((
+                'max_db_time', '%.3f' % counter.time, self.max_db_time, 's'
+            ))
+        return breaches
+
+    def enforce(self, endpoint, counter, response):
+        """
+        Return the response to send after a request that ran 'counter''s
+        queries: a 400 in DEBUG mode if it was over budget. In production,
+        breaches are counted (see django_api.failures).
+
+        A streaming response's queries are counted as it is sent, and
+        breaches are always counted rather than failed, since the status
+        has been sent by then.
+        """
+        if getattr(response, 'streaming', False):
+            response.streaming_content = counter.iter_counted(
+                response.streaming_content,
+                lambda: self._record(endpoint, counter),
+            )
+            return response
+        breaches = self.breaches(counter)
+        if not breaches:
+            return response
+        if settings.DEBUG:
+            return JsonResponseBadRequest('API %s' % ', '.join(
+                _format_breach(count, limit, unit)
+                for (code, count, limit, unit) in breaches
+            ))
+        self._record(endpoint, counter, breaches)
+        return response
+
+    def _record(self, endpoint, counter, breaches=None):
+        if breaches is None:
+            breaches = self.breaches(counter)
+        for (code, count, limit, unit) in breaches:
+            failures.record(endpoint, 'queries', code, _format_breach,
+                            count, limit, unit)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Return (func(*args, **kwargs), QueryCounter of the queries it ran).
+        """
+        counter = QueryCounter()
+        with counter:
+            response = func(*args, **kwargs)
+        return (response, counter)
+
+    async def acall(self, func, *args, **kwargs):
+        # Async views run their queries in the thread that sync_to_async()
+        # uses for sync code, so the wrapper goes there. That thread copies
+        # the caller's context, so only this request's queries are counted.
+        counter = QueryCounter()
+        await sync_to_async(install_wrapper)()
+        counter.activate()
+        try:
+            response = await func(*args, **kwargs)
+        finally:
+            counter.deactivate()
+        return (response, counter)
@@ -0,0 +1,139 @@
+import hashlib
+from django.core.cache import caches
+from django.db import models
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.utils.http import quote_etag
+from django_api.json_helpers import EncodedJsonResponse
+from django_api.json_helpers import JsonResponse
+from django_api.negotiation import response_backend
+
+
+def _cache_key_value(value):
+    """
+    Normalize a cleaned_data value for use in a cache key.
+    """
+    if isinstance(value, models.Model):
+        return (value._meta.app_label, value._meta.model_name, value.pk)
+    elif isinstance(value, (list, tuple)):
+        return tuple(_cache_key_value(item) for item in value)
+    return value
+
+
+def request_key(request, vary_on_user=False):
+    """
+    Return a digest of the request path and validated GET input (and the
+    current user, with 'vary_on_user'), and the negotiated binary format.
+    """
+    data = request.GET
+    if hasattr(data, 'lists'):
+        items = data.lists()
+    else:
+        items = data.items()
+    key = [request.path, sorted(
+        (name, _cache_key_value(value)) for (name, value) in items
+    )]
+    if vary_on_user:
+        user = getattr(request, 'user', None)
+        key.append(getattr(user, 'pk', None))
+    backend = response_backend()
+    if backend.binary:
+        key.append(backend.name)
+    return hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, and compression may have turned
+    # the ETag we sent into a weak one.
+    etags = [tag[2:] if tag.startswith('W/') else tag
+             for tag in parse_etags(if_none_match)]
+    return '*' in etags or etag in etags
+
+
+class ResponseCache(object):
+    """
+    Stores 200 GET responses in Django's cache; see @api_cache.
+    """
+
+    def __init__(self, timeout=60, vary_on_user=False, max_size=1024 * 1024,
+                 cache_alias='default'):
+        self.timeout = timeout
+        self.vary_on_user = vary_on_user
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+
+    def make_key(self, request):
+        return 'django_api:response:%s' % request_key(
+            request, self.vary_on_user
+        )
+
+    def get(self, request):
+        """
+        Return (key, cached response or None) for a GET request.
+        """
+        key = self.make_key(request)
+        return (key, self._replay(request, caches[self.cache_alias].get(key)))
+
+    async def aget(self, request):
+        key = self.make_key(request)
+        cached = await caches[self.cache_alias].aget(key)
+        return (key, self._replay(request, cached))
+
+    def set(self, request, key, response):
+        """
+        Cache 'response' under 'key' if it can be cached, and return the
+        response to send.
+        """
+        entry = self._make_entry(response)
+        if entry is None:
+            return response
+        if entry[1] is not None:
+            caches[self.cache_alias].set(key, entry, self.timeout)
+        return self._tag(request, response, entry[0])
+
+    async def aset(self, request, key, response):
+        entry = self._make_entry(response)
+        if entry is None:
+            return response
+        if entry[1] is not None:
+            await caches[self.cache_alias].aset(key, entry, self.timeout)
+        return self._tag(request, response, entry[0])
+
+    def _replay(self, request, cached):
+        if cached is None:
+            return None
+        (etag, content, headers) = cached
+        if etag_matches(request, etag):
+            return HttpResponseNotModified()
+        response = EncodedJsonResponse(
+            content, content_type=response_backend().content_type
+        )
+        # The headers the view set, such as Cache-Control.
+        for (header, value) in headers:
+            response[header] = value
+        response['ETag'] = etag
+        return response
+
+    def _make_entry(self, response):
+        """
+        Return the (etag, content, headers) cache entry for 'response', with
+        a None content if it is too large to cache, or None if it is not
+        cacheable at all.
+        """
+        if (not isinstance(response, JsonResponse) or
+                response.status_code != 200):
+            return None
+        content = response.content
+        etag = quote_etag(hashlib.md5(content).hexdigest())
+        if len(content) > self.max_size:
+            return (etag, None, None)
+        return (etag, content, list(response.items()))
+
+    def _tag(self, request, response, etag):
+        if etag_matches(request, etag):
+            return HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
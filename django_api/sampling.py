@@ -0,0 +1,95 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_MODES = ('inline', 'shadow')
+
+
+class ValidationPolicy(object):
+    """
+    How often, and where, an API's contract checks run in production.
+
+    'sample_rate' is the fraction of requests that are checked, and 'mode'
+    is 'inline' (checked before the response is returned) or 'shadow'
+    (checked in a background thread). Either defaults to the
+    DJANGO_API_VALIDATION_SAMPLE_RATE (1.0) and DJANGO_API_VALIDATION_MODE
+    ('inline') settings. In DEBUG mode every request is checked inline,
+    since failures change the response.
+    """
+
+    def __init__(self, sample_rate=None, mode=None):
+        if mode is not None and mode not in VALIDATION_MODES:
+            raise ValueError('unknown validation mode \'%s\'' % mode)
+        self._sample_rate = sample_rate
+        self._mode = mode
+
+    @property
+    def sample_rate(self):
+        if self._sample_rate is not None:
+            return self._sample_rate
+        return getattr(settings, 'DJANGO_API_VALIDATION_SAMPLE_RATE', 1.0)
+
+    @property
+    def mode(self):
+        if self._mode is not None:
+            return self._mode
+        return getattr(settings, 'DJANGO_API_VALIDATION_MODE', 'inline')
+
+    def should_check(self):
+        """
+        Return whether the current request is sampled for checking.
+        """
+        if settings.DEBUG:
+            return True
+        sample_rate = self.sample_rate
+        return sample_rate >= 1 or random.random() < sample_rate
+
+    def run(self, check, *args):
+        """
+        Run 'check(*args)' according to the policy, and return its result,
+        or None if it was skipped or moved to the background.
+        """
+        if settings.DEBUG:
+            return check(*args)
+        if not self.should_check():
+            return None
+        if self.mode == 'shadow':
+            run_in_background(check, *args)
+            return None
+        return check(*args)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = [0]
+
+# Shadow checks beyond this backlog are dropped rather than queued.
+MAX_PENDING = 1000
+
+
+def _done(future):
+    with _executor_lock:
+        _pending[0] -= 1
+    if future.exception() is not None:
+        logger.error('shadow validation failed', exc_info=future.exception())
+
+
+def run_in_background(func, *args):
+    """
+    Run 'func(*args)' on the shadow validation thread.
+    """
+    global _executor
+    with _executor_lock:
+        if _pending[0] >= MAX_PENDING:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='django_api_shadow'
+            )
+        _pending[0] += 1
+    _executor.submit(func, *args).add_done_callback(_done)
@@ -0,0 +1,427 @@
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.forms.utils import ErrorDict
+from django.forms.utils import ErrorList
+from django_api import model_cache
+
+
+# Field types whose clean() is free of per-form state, and can therefore be
+# validated without instantiating (and deep-copying) a full forms.Form.
+FAST_FIELD_TYPES = (
+    forms.IntegerField,
+    forms.CharField,
+    forms.BooleanField,
+    forms.DateField,
+    forms.ChoiceField,
+)
+
+
+class FastForm(object):
+    """
+    A minimal stand-in for a bound forms.Form.
+
+    Runs each field's widget and clean() directly against the shared field
+    instances, skipping the per-request form class and field deep-copies.
+    'cleaned_data' and 'errors' match what the equivalent forms.Form would
+    produce.
+    """
+
+    def __init__(self, fields, data):
+        self._fields = fields
+        self.data = data
+        self._errors = None
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            self.full_clean()
+        return self._errors
+
+    def is_valid(self):
+        return not self.errors
+
+    def full_clean(self):
+        self._errors = ErrorDict()
+        self.cleaned_data = {}
+        for (name, field) in self._fields:
+            value = field.widget.value_from_datadict(self.data, {}, name)
+            try:
+                self.cleaned_data[name] = field.clean(value)
+            except ValidationError as e:
+                self._errors[name] = ErrorList()
+                self._errors[name].extend(e.error_list)
+
+
+class ModelLookup(object):
+    """
+    An accepts entry that resolves '<key>-id' to an instance of 'model'.
+
+    Equivalent to passing 'model()' in the accepts dict, but also takes
+    queryset hints so the view doesn't trigger lazy follow-up queries:
+
+    'accepts': {
+        'course': ModelLookup(Course, select_related=['org'],
+                              only=['id', 'name', 'org__name']),
+    }
+    """
+
+    def __init__(self, model, select_related=None, prefetch_related=None,
+                 only=None):
+        self.model = model
+        self.select_related = tuple(select_related or ())
+        self.prefetch_related = tuple(prefetch_related or ())
+        self.only = tuple(only or ())
+
+    @property
+    def key(self):
+        return (self.model, self.select_related, self.prefetch_related,
+                self.only)
+
+    @property
+    def plain(self):
+        return not (self.select_related or self.prefetch_related or
+                    self.only)
+
+    def get_queryset(self):
+        queryset = self.model.objects.all()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+class ObjectNotFound(Exception):
+    """
+    Raised when a model lookup has no object with the requested primary key.
+    """
+
+    def __init__(self, model, pk):
+        super(ObjectNotFound, self).__init__(model, pk)
+        self.model = model
+        self.pk = pk
+
+
+def _start_group(lookup, lookup_cache, field_names, field_pks, identity_map):
+    """
+    Return the set of pks a lookup group needs, and a dict of the ones
+    already in the request's identity map.
+    """
+    pks = set(field_pks[field_name] for field_name in field_names)
+    found = {}
+    if lookup_cache is not None and identity_map is not None:
+        for pk in pks:
+            if (lookup.key, pk) in identity_map:
+                found[pk] = identity_map[(lookup.key, pk)]
+        pks.difference_update(found)
+    return (pks, found)
+
+
+def _finish_group(lookup, lookup_cache, field_names, field_pks, identity_map,
+                  found, objects):
+    """
+    Record a lookup group's objects in the identity map and in 'objects'.
+    """
+    if lookup_cache is not None and identity_map is not None:
+        for (pk, obj) in found.items():
+            identity_map[(lookup.key, pk)] = obj
+    for field_name in field_names:
+        try:
+            objects[field_name] = found[field_pks[field_name]]
+        except KeyError:
+            raise ObjectNotFound(lookup.model, field_pks[field_name])
+
+
+class AcceptsSchema(object):
+    """
+    The compiled form of an api_accepts 'fields' dict.
+
+    Everything that depends only on the 'fields' dict (the form class and the
+    list of models.Model lookups) is computed once, when the decorator is
+    applied, rather than on every request.
+    """
+
+    def __init__(self, fields):
+        form_fields = {}
+        self.model_fields = []
+        for (field_name, field_instance) in fields.items():
+            if isinstance(field_instance, models.Model):
+                self.model_fields.append(
+                    (field_name, ModelLookup(type(field_instance)))
+                )
+            elif isinstance(field_instance, ModelLookup):
+                self.model_fields.append((field_name, field_instance))
+            else:
+                form_fields[field_name] = field_instance
+
+        # Group model fields that can be fetched with the same query, so each
+        # group costs a single in_bulk() round-trip.
+        groups = {}
+        self.model_groups = []
+        for (field_name, lookup) in self.model_fields:
+            if lookup.key not in groups:
+                groups[lookup.key] = (lookup, [])
+                self.model_groups.append(groups[lookup.key])
+            groups[lookup.key][1].append(field_name)
+
+        # The dict passed into the type() function is modified, so send in a
+        # copy instead.
+        self.form_class = type('ApiForm', (forms.Form,), form_fields.copy())
+
+        # Only offer the fast path if every field is one of the plain types
+        # it knows how to handle.
+        self.fast_fields = None
+        if all(type(field) in FAST_FIELD_TYPES and
+               not getattr(field, 'disabled', False)
+               for field in form_fields.values()):
+            self.fast_fields = [
+                (name, self.form_class.base_fields[name])
+                for name in self.form_class.base_fields
+            ]
+
+    def model_pks(self, request):
+        """
+        Return a dict of field name => primary key for the model fields,
+        read from the '<key>-id' request parameters.
+
+        Raises KeyError with the field name if a parameter is missing.
+        """
+        field_pks = {}
+        for (field_name, lookup) in self.model_fields:
+            # TODO: irregular, should we remove?
+            field_id = '%s-id' % field_name
+            if field_id in request.POST:
+                field_pks[field_name] = int(request.POST[field_id])
+            elif field_id in request.GET:
+                field_pks[field_name] = int(request.GET[field_id])
+            else:
+                raise KeyError(field_name)
+        return field_pks
+
+    def resolve_models(self, field_pks, identity_map=None):
+        """
+        Return a dict of field name => model instance for 'field_pks', using
+        one query per group of fields.
+
+        For models registered with django_api.model_cache, instances are
+        first looked up in 'identity_map' (a dict that lives for one request)
+        and then in the model cache, so only the remaining pks reach the
+        database.
+
+        Raises ObjectNotFound for the first primary key that does not exist.
+        """
+        objects = {}
+        for (lookup, field_names) in self.model_groups:
+            lookup_cache = model_cache.get_model_cache(lookup.model)
+            (pks, found) = _start_group(lookup, lookup_cache, field_names,
+                                        field_pks, identity_map)
+            # Hinted lookups are not shared through the cache, since their
+            # results depend on related rows that invalidation doesn't track.
+            if lookup_cache is not None and lookup.plain and pks:
+                found.update(lookup_cache.get_many(pks))
+                pks.difference_update(found)
+            if pks:
+                fetched = lookup.get_queryset().in_bulk(pks)
+                if lookup_cache is not None and lookup.plain:
+                    lookup_cache.set_many(fetched)
+                found.update(fetched)
+            _finish_group(lookup, lookup_cache, field_names, field_pks,
+                          identity_map, found, objects)
+        return objects
+
+    async def aresolve_models(self, field_pks, identity_map=None):
+        """
+        Async version of resolve_models(), using the async ORM and cache
+        APIs.
+        """
+        objects = {}
+        for (lookup, field_names) in self.model_groups:
+            lookup_cache = model_cache.get_model_cache(lookup.model)
+            (pks, found) = _start_group(lookup, lookup_cache, field_names,
+                                        field_pks, identity_map)
+            if lookup_cache is not None and lookup.plain and pks:
+                found.update(await lookup_cache.aget_many(pks))
+                pks.difference_update(found)
+            if pks:
+                fetched = await lookup.get_queryset().ain_bulk(pks)
+                if lookup_cache is not None and lookup.plain:
+                    await lookup_cache.aset_many(fetched)
+                found.update(fetched)
+            _finish_group(lookup, lookup_cache, field_names, field_pks,
+                          identity_map, found, objects)
+        return objects
+
+    def bind(self, data):
+        """
+        Return a bound form (or FastForm) for 'data'.
+
+        The fast validator is used when the DJANGO_API_FAST_VALIDATION setting
+        is on and every field in the schema supports it.
+        """
+        if (self.fast_fields is not None and
+                getattr(settings, 'DJANGO_API_FAST_VALIDATION', False)):
+            return FastForm(self.fast_fields, data)
+        return self.form_class(data)
+
+
+# Plain types allowed in a JsonSchema, with the name used in errors.
+JSON_TYPES = (
+    (bool, 'a boolean'),
+    (int, 'an integer'),
+    (float, 'a number'),
+    (str, 'a string'),
+    (dict, 'an object'),
+    (list, 'an array'),
+)
+
+
+def _json_any(value, path, errors):
+    return value
+
+
+def _json_error(errors, path, messages):
+    errors.setdefault(path or '__all__', ErrorList()).extend(messages)
+
+
+def _json_field(field):
+    def validate(value, path, errors):
+        try:
+            return field.clean(value)
+        except ValidationError as e:
+            _json_error(errors, path, e.messages)
+    return validate
+
+
+def _json_type(json_type, description):
+    if json_type is int:
+        # bool is a subclass of int, but true is not an integer in JSON.
+        def check(value):
+            return isinstance(value, int) and not isinstance(value, bool)
+    elif json_type is float:
+        def check(value):
+            return (isinstance(value, (int, float)) and
+                    not isinstance(value, bool))
+    else:
+        def check(value):
+            return isinstance(value, json_type)
+    message = ['Expected %s.' % description]
+
+    def validate(value, path, errors):
+        if not check(value):
+            _json_error(errors, path, message)
+        return value
+    return validate
+
+
+def _json_object(validators):
+    required = ['This field is required.']
+    expected = ['Expected an object.']
+
+    def validate(value, path, errors):
+        if not isinstance(value, dict):
+            _json_error(errors, path, expected)
+            return None
+        prefix = path + '.' if path else ''
+        cleaned = {}
+        for (name, validator, is_field) in validators:
+            if name in value:
+                cleaned[name] = validator(value[name], prefix + name, errors)
+            elif is_field:
+                # Form fields decide for themselves whether they are
+                # required, and what their empty value is.
+                cleaned[name] = validator(None, prefix + name, errors)
+            else:
+                _json_error(errors, prefix + name, required)
+        return cleaned
+    return validate
+
+
+def _json_array(validator):
+    expected = ['Expected an array.']
+
+    def validate(value, path, errors):
+        if not isinstance(value, list):
+            _json_error(errors, path, expected)
+            return None
+        return [validator(item, '%s[%d]' % (path, i), errors)
+                for (i, item) in enumerate(value)]
+    return validate
+
+
+def _compile_json(spec):
+    if spec is None:
+        return _json_any
+    if isinstance(spec, forms.Field):
+        return _json_field(spec)
+    if isinstance(spec, dict):
+        return _json_object([
+            (name, _compile_json(item), isinstance(item, forms.Field))
+            for (name, item) in spec.items()
+        ])
+    if isinstance(spec, list) and len(spec) == 1:
+        return _json_array(_compile_json(spec[0]))
+    for (json_type, description) in JSON_TYPES:
+        if spec is json_type:
+            return _json_type(json_type, description)
+    raise ImproperlyConfigured('invalid JSON schema entry %r' % (spec,))
+
+
+class JsonSchema(object):
+    """
+    A JSON body specification, compiled once into nested validators.
+
+    The spec is a dict mapping each property to one of:
+
+    * a form field, which cleans the value (missing values are handled by
+      the field's 'required' flag),
+    * a plain type (str, int, float, bool, dict or list), which the value
+      must be an instance of,
+    * a nested dict spec, for an object,
+    * a one-item list such as [spec], for an array of values matching spec,
+    * None, for a value of any type.
+
+    Properties other than form fields are required, and properties missing
+    from the spec are dropped from the cleaned data. For example:
+
+    JsonSchema({
+        'name': forms.CharField(max_length=100),
+        'tags': [str],
+        'items': [{'sku': str, 'quantity': forms.IntegerField(min_value=1)}],
+    })
+
+    A set, tuple or list of property names only requires that those
+    properties are present, and passes the whole body through unchanged.
+    """
+
+    def __init__(self, spec):
+        self.passthrough = (
+            isinstance(spec, (set, frozenset, tuple, list)) and
+            all(isinstance(name, str) for name in spec)
+        )
+        if self.passthrough:
+            self.required_fields = tuple(spec)
+            self._validate = None
+        else:
+            self.required_fields = ()
+            self._validate = _compile_json(spec)
+
+    def clean(self, data):
+        """
+        Return (cleaned data, errors), where errors is an ErrorDict keyed by
+        the path of each invalid value ('items[2].sku').
+        """
+        errors = ErrorDict()
+        if self.passthrough:
+            if not isinstance(data, dict):
+                _json_error(errors, '', ['Expected an object.'])
+                return (None, errors)
+            for name in self.required_fields:
+                if name not in data:
+                    _json_error(errors, name, ['This field is required.'])
+            return (data, errors)
+        return (self._validate(data, '', errors), errors)
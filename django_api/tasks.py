@@ -0,0 +1,257 @@
+"""
+Background execution for @api views declared with 'async_task'.
+
+The view runs on an executor after its input has been validated, and the
+client gets a 202 with a job id. The job's response is stored in Django's
+cache (DJANGO_API_TASK_CACHE, default 'default', for
+DJANGO_API_TASK_TIMEOUT seconds, default 3600), where the job_status view
+returns it. Use a cache shared by all processes, such as memcached or Redis.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import NoReverseMatch
+from django.urls import reverse
+from django_api.json_helpers import EncodedJsonResponse
+from django_api.json_helpers import JsonResponseAccepted
+from django_api.json_helpers import JsonResponseError
+from django_api.json_helpers import JsonResponseNotFound
+from django_api.json_helpers import JsonResponseServiceUnavailable
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _owner(request):
+    user = getattr(request, 'user', None)
+    return getattr(user, 'pk', None)
+
+
+class JobStore(object):
+    """
+    Keeps the state and response of each job in Django's cache.
+    """
+
+    def __init__(self, cache_alias=None, timeout=None):
+        self.cache_alias = cache_alias or getattr(
+            settings, 'DJANGO_API_TASK_CACHE', 'default'
+        )
+        self.timeout = timeout or getattr(
+            settings, 'DJANGO_API_TASK_TIMEOUT', 3600
+        )
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def make_key(self, job_id):
+        return 'django_api:job:%s' % job_id
+
+    def create(self, request):
+        """
+        Return the id of a new pending job, owned by the user of 'request'.
+        """
+        job_id = uuid.uuid4().hex
+        self.cache.set(self.make_key(job_id), {
+            'status': PENDING,
+            'owner': _owner(request),
+        }, self.timeout)
+        return job_id
+
+    def get(self, job_id):
+        return self.cache.get(self.make_key(job_id))
+
+    def update(self, job_id, **fields):
+        """
+        Update the entry of a job, and return False if it no longer exists
+        (it expired). Entries are never recreated, since that would lose
+        their owner.
+        """
+        entry = self.get(job_id)
+        if entry is None:
+            return False
+        entry.update(fields)
+        self.cache.set(self.make_key(job_id), entry, self.timeout)
+        return True
+
+    def delete(self, job_id):
+        self.cache.delete(self.make_key(job_id))
+
+
+class TaskQueue(object):
+    """
+    Submits jobs to 'executor' (any object with a concurrent.futures-style
+    submit(), such as a ThreadPoolExecutor), refusing new jobs while
+    'max_pending' are queued or running.
+
+    The default executor is a pool of DJANGO_API_TASK_WORKERS threads
+    (default 4), and 'max_pending' defaults to DJANGO_API_TASK_MAX_PENDING
+    (default 100).
+    """
+
+    def __init__(self, executor=None, max_pending=None):
+        self._executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'DJANGO_API_TASK_WORKERS',
+                                        4),
+                    thread_name_prefix='django_api_task',
+                )
+            return self._executor
+
+    def submit(self, func, *args):
+        """
+        Submit 'func(*args)', and return False if the queue is full.
+        """
+        max_pending = self.max_pending
+        if max_pending is None:
+            max_pending = getattr(settings, 'DJANGO_API_TASK_MAX_PENDING',
+                                  100)
+        with self._lock:
+            if self.pending >= max_pending:
+                return False
+            self.pending += 1
+        try:
+            self.executor.submit(self._run, func, *args)
+        except Exception:
+            self._done()
+            raise
+        return True
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._lock:
+            self.pending -= 1
+
+
+_default_queue = TaskQueue()
+
+
+class BackgroundTask(object):
+    """
+    Runs an endpoint's view as a job; see the 'async_task' key of @api.
+    Jobs are kept in 'store' (default: a JobStore with the default
+    settings).
+    """
+
+    def __init__(self, executor=None, max_pending=None, store=None):
+        if executor is None and max_pending is None:
+            self.queue = _default_queue
+        else:
+            self.queue = TaskQueue(executor, max_pending)
+        if store is None:
+            self.store = JobStore()
+            self.status_view = job_status
+        else:
+            self.store = store
+            self.status_view = job_status_view(store)
+
+    def submit(self, request, func, *args):
+        """
+        Queue 'func(*args)', which returns the view's response, and return
+        the 202 (or 503, if the queue is full) response to send now.
+        """
+        job_id = self.store.create(request)
+        if not self.queue.submit(self.run, job_id, func, *args):
+            self.store.delete(job_id)
+            return JsonResponseServiceUnavailable('too many pending jobs')
+        response = JsonResponseAccepted({'job_id': job_id, 'status': PENDING})
+        try:
+            response['Location'] = reverse(self.status_view, args=[job_id])
+        except NoReverseMatch:
+            pass
+        return response
+
+    def run(self, job_id, func, *args):
+        close_old_connections()
+        try:
+            if not self.store.update(job_id, status=RUNNING):
+                logger.warning('job %s expired before it ran', job_id)
+                return
+            response = func(*args)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+            self.store.update(
+                job_id,
+                status=DONE,
+                status_code=response.status_code,
+                content_type=response.get('Content-Type'),
+                content=content,
+            )
+        except Exception:
+            logger.exception('job %s failed', job_id)
+            self.store.update(job_id, status=FAILED)
+        finally:
+            close_old_connections()
+
+
+def _job_status(store, request, job_id):
+    entry = store.get(job_id)
+    if entry is None or entry.get('owner') != _owner(request):
+        return JsonResponseNotFound('job %s does not exist' % job_id)
+    status = entry['status']
+    if status in (PENDING, RUNNING):
+        return JsonResponseAccepted({'job_id': job_id, 'status': status})
+    if status == FAILED:
+        return JsonResponseError('job %s failed' % job_id)
+    content_type = entry.get('content_type') or ''
+    if content_type.startswith('application/json'):
+        return EncodedJsonResponse(entry['content'], entry['status_code'])
+    return HttpResponse(entry['content'], status=entry['status_code'],
+                        content_type=content_type or None)
+
+
+def job_status(request, job_id):
+    """
+    Return the state of a job started by an 'async_task' endpoint: a 202
+    with {"job_id": ..., "status": "pending" or "running"} until it is
+    done, then the response of the view. Only the user who started the job
+    can see it. For example, in your URLconf:
+
+        path('api/jobs/<str:job_id>', job_status),
+
+    For endpoints given their own 'store', route job_status_view(store)
+    instead.
+    """
+    return _job_status(JobStore(), request, job_id)
+
+
+def job_status_view(store):
+    """
+    Return a view like job_status for the jobs kept in 'store'. The same
+    view is returned for each call with the same store, so that it can be
+    reversed.
+    """
+    try:
+        return store._status_view
+    except AttributeError:
+        pass
+
+    def status_view(request, job_id):
+        return _job_status(store, request, job_id)
+    store._status_view = status_view
+    return status_view
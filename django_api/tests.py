@@ -1,22 +1,115 @@
+import asyncio
 import datetime
+import decimal
+import gzip
+import io
 import json
 import logging
+import threading
+import time
+from unittest import mock
 from django import forms
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.http import HttpResponse
 from django.test import TestCase
+from django.urls import path
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
+from django_api.admission import SharedConcurrencyLimit
+from django_api.batch import BatchView
+from django_api.compression import compress_response
 from django_api.decorators import api
+from django_api.decorators import ApiEndpoint
 from django_api.decorators import api_accepts
+from django_api.decorators import api_coalesce
+from django_api.decorators import api_limit
 from django_api.decorators import api_returns
+from django_api.decorators import validate_json_request
+from django_api.json_helpers import ajson_response
 from django_api.json_helpers import JsonResponse
+from django_api.json_helpers import JsonResponseEncoder
 from django_api.json_helpers import JsonResponseForbidden
 from django_api.json_helpers import JsonResponseAccepted
 from django_api.json_helpers import JsonResponseWithStatus
+from django_api.json_helpers import StreamingJsonResponse
+from django_api import benchmarks
+from django_api import coalescing
+from django_api import failures
+from django_api import ingest
+from django_api import json_backends
+from django_api import model_cache
+from django_api import model_serializers
+from django_api import tasks
+from django_api.fieldsets import FieldsetField
+from django_api.pagination import Cursor
+from django_api.pagination import CursorField
+from django_api.pagination import PaginatedJsonResponse
+from django_api import timing
+from django_api.sampling import ValidationPolicy
+from django_api.schema import AcceptsSchema
+from django_api.schema import FastForm
+from django_api.schema import JsonSchema
+from django_api.schema import ModelLookup
+from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
 
 logger = logging.getLogger(__name__)
 
 
+@api({
+    'accepts': {
+        'x': forms.IntegerField(min_value=0),
+    },
+    'returns': {
+        200: 'OK',
+    },
+})
+def batch_echo_view(request):
+    return JsonResponse({'method': request.method, 'x': request.GET['x']})
+
+
+@api_accepts({
+    'x': forms.IntegerField(min_value=0),
+})
+async def batch_async_view(request):
+    return JsonResponseAccepted({'x': request.POST['x']})
+
+
+def batch_plain_view(request):
+    return JsonResponse()
+
+
+@validate_json_request({'name'})
+def batch_json_view(request, request_dict):
+    return JsonResponse({'name': request_dict['name']})
+
+
+class ListSink(object):
+    """
+    A failures sink that keeps the summaries it is given.
+    """
+
+    def __init__(self):
+        self.summaries = []
+
+    def report(self, summaries):
+        self.summaries.extend(summaries)
+
+
+urlpatterns = [
+    path('echo', batch_echo_view),
+    path('async', batch_async_view),
+    path('plain', batch_plain_view),
+    path('json', batch_json_view),
+    path('batch', BatchView(max_workers=2)),
+    path('jobs/<str:job_id>', tasks.job_status),
+]
+
+
 class SimpleTest(TestCase):
 
     @override_settings(DEBUG=True)
@@ -245,3 +338,1240 @@ class SimpleTest(TestCase):
         request = rf.get('/simple_view', data={'im_required': '1'})
         response = simple_view(request)
         self.assertEquals(response.status_code, 400)
+
+    def test_fast_validation_matches_form(self):
+        """
+        Test that the fast validator produces the same cleaned_data and errors
+        as the full Django form.
+        """
+        schema = AcceptsSchema({
+            'i': forms.IntegerField(min_value=0),
+            'c': forms.CharField(max_length=3, required=False),
+            'b': forms.BooleanField(required=False),
+            'd': forms.DateField(),
+            'ch': forms.ChoiceField(choices=[('a', 'A'), ('b', 'B')]),
+        })
+        self.assertIsNotNone(schema.fast_fields)
+
+        for data in [
+            {'i': '1', 'c': 'abc', 'b': 'true', 'd': '2010-02-17', 'ch': 'a'},
+            {'i': '-1', 'c': 'abcd', 'd': 'not a date', 'ch': 'z'},
+            {},
+        ]:
+            form = schema.form_class(data)
+            fast_form = FastForm(schema.fast_fields, data)
+            self.assertEquals(form.is_valid(), fast_form.is_valid())
+            self.assertEquals(dict(form.errors), dict(fast_form.errors))
+            self.assertEquals(form.cleaned_data, fast_form.cleaned_data)
+
+        # Unsupported field types fall back to the full form.
+        schema = AcceptsSchema({'f': forms.FloatField()})
+        self.assertIsNone(schema.fast_fields)
+
+    @override_settings(DEBUG=True)
+    def test_api_accepts_batched_models(self):
+        """
+        Test that model fields of the same type are resolved with one query.
+        """
+        rf = RequestFactory()
+        first = User.objects.create(username='first')
+        second = User.objects.create(username='second')
+
+        @api_accepts({
+            'first': User(),
+            'second': User(),
+            'third': ModelLookup(User, only=['id', 'username']),
+        })
+        def model_view(request, *args, **kwargs):
+            self.assertEquals(request.GET['first'], first)
+            self.assertEquals(request.GET['second'], second)
+            self.assertEquals(request.GET['third'].username, 'first')
+            return JsonResponse()
+
+        request = rf.get('/model_success', data={
+            'first-id': first.id,
+            'second-id': second.id,
+            'third-id': first.id,
+        })
+        with self.assertNumQueries(2):
+            response = model_view(request)
+        self.assertEquals(response.status_code, 200)
+
+        request = rf.get('/model_failure', data={
+            'first-id': first.id,
+            'second-id': 99999,
+            'third-id': first.id,
+        })
+        response = model_view(request)
+        self.assertEquals(response.status_code, 404)
+
+        request = rf.get('/model_failure', data={'first-id': first.id})
+        response = model_view(request)
+        self.assertEquals(response.status_code, 400)
+
+    @override_settings(DEBUG=True)
+    def test_api_accepts_model_cache(self):
+        """
+        Test that registered models are served from the cache, and that saves
+        invalidate cached entries.
+        """
+        rf = RequestFactory()
+        user = User.objects.create(username='cached')
+        user_cache = model_cache.register(User, timeout=60, max_entries=10)
+        self.addCleanup(model_cache.unregister, User)
+
+        @api_accepts({
+            'user': User(),
+        })
+        def model_view(request, *args, **kwargs):
+            return JsonResponse({'username': request.GET['user'].username})
+
+        with self.assertNumQueries(1):
+            model_view(rf.get('/model_success', data={'user-id': user.id}))
+        with self.assertNumQueries(0):
+            response = model_view(
+                rf.get('/model_success', data={'user-id': user.id})
+            )
+        self.assertEquals(json.loads(response.content)['username'], 'cached')
+
+        user.username = 'renamed'
+        user.save()
+        response = model_view(
+            rf.get('/model_success', data={'user-id': user.id})
+        )
+        self.assertEquals(json.loads(response.content)['username'], 'renamed')
+        self.assertEquals(user_cache.hits, 1)
+        self.assertEquals(user_cache.misses, 2)
+        self.assertEquals(
+            model_cache.stats()['auth.user'], {'hits': 1, 'misses': 2}
+        )
+
+    def test_streaming_json_response(self):
+        """
+        Test that StreamingJsonResponse streams QuerySets as JSON arrays.
+        """
+        for i in range(5):
+            User.objects.create(username='user%d' % i)
+        response = StreamingJsonResponse({
+            'count': 5,
+            'users': User.objects.order_by('id'),
+            'date': datetime.date(2010, 2, 17),
+        }, chunk_size=2)
+        response_json = json.loads(b''.join(response.streaming_content))
+        self.assertEquals(response_json['count'], 5)
+        self.assertEquals(response_json['date'], '2010-02-17')
+        self.assertEquals(
+            [user['username'] for user in response_json['users']],
+            ['user%d' % i for i in range(5)]
+        )
+
+    def test_json_backends(self):
+        """
+        Test that the JSON backends encode Django types like
+        JsonResponseEncoder.
+        """
+        user = User.objects.create(username='encoded')
+        data = {
+            'date': datetime.date(2010, 2, 17),
+            'datetime': datetime.datetime(2006, 11, 21, 16, 30, 0, 123456),
+            'time': datetime.time(16, 30),
+            'decimal': decimal.Decimal('1.10'),
+            'text': u'caf\xe9',
+            'user': user,
+            'users': User.objects.all(),
+            1: [None, True, 1.5],
+        }
+        expected = JsonResponseEncoder(separators=(',', ':')).encode(data)
+        self.assertEquals(JsonResponse(data).content, expected.encode())
+
+        for (name, backend_class) in json_backends.BACKENDS.items():
+            try:
+                backend = backend_class()
+            except ImportError:
+                continue
+            content_json = json.loads(backend.dumps(data))
+            expected_json = json.loads(expected)
+            # Decimals must keep their exact value, as strings.
+            self.assertEquals(content_json['decimal'], '1.10')
+            # Integers beyond 64 bits are encoded exactly.
+            self.assertEquals(json.loads(backend.dumps({'big': 2 ** 70})),
+                              {'big': 2 ** 70})
+            self.assertEquals(content_json, expected_json)
+
+        with override_settings(DJANGO_API_JSON_BACKEND='unknown'):
+            self.assertRaises(ImproperlyConfigured, json_backends.get_backend)
+
+    def test_model_serializers(self):
+        """
+        Test that models and QuerySets are encoded as nested objects.
+        """
+        user = User.objects.create(
+            username='serialized',
+            date_joined=datetime.datetime(2006, 11, 21, 16, 30),
+        )
+        # Reload, so the instance holds what values() reads (aware
+        # datetimes with USE_TZ).
+        user = User.objects.get(pk=user.pk)
+        permission = Permission.objects.all()[0]
+        with self.assertNumQueries(1):
+            response = JsonResponse({
+                'user': user,
+                'users': User.objects.all(),
+                'permission': permission,
+            })
+        response_json = json.loads(response.content)
+        self.assertEquals(response_json['user']['username'], 'serialized')
+        self.assertEquals(response_json['user']['date_joined'],
+                          DjangoJSONEncoder().default(user.date_joined))
+        self.assertEquals(response_json['users'], [response_json['user']])
+        self.assertEquals(response_json['permission']['content_type'],
+                          permission.content_type_id)
+
+        model_serializers.register(User, fields=['id', 'username'])
+        self.addCleanup(model_serializers._registry.pop, User)
+        response = JsonResponse(User.objects.values('id', 'username'))
+        self.assertEquals(json.loads(response.content),
+                          [{'id': user.id, 'username': 'serialized'}])
+        response = JsonResponse(User.objects.all())
+        self.assertEquals(json.loads(response.content),
+                          [{'id': user.id, 'username': 'serialized'}])
+
+    @override_settings(DEBUG=True)
+    def test_api_cache_decorator(self):
+        """
+        Test that @api caches responses keyed on validated input, and answers
+        If-None-Match with a 304.
+        """
+        calls = []
+
+        @api({
+            'accepts': {
+                'x': forms.IntegerField(),
+            },
+            'returns': {
+                200: 'OK',
+            },
+            'cache': {
+                'timeout': 60,
+            },
+        })
+        def cached_view(request):
+            calls.append(request.GET['x'])
+            response = JsonResponse({'x': request.GET['x']})
+            response['Cache-Control'] = 'max-age=60'
+            response['X-Computed'] = str(request.GET['x'])
+            return response
+
+        rf = RequestFactory()
+        response = cached_view(rf.get('/cached_view', data={'x': '1'}))
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+
+        # '01' cleans to the same value as '1'.
+        response = cached_view(rf.get('/cached_view', data={'x': '01'}))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), {'x': 1})
+        self.assertEquals(response['ETag'], etag)
+        self.assertEquals(calls, [1])
+        # Headers set by the view survive a cache hit.
+        self.assertEquals(response['Cache-Control'], 'max-age=60')
+        self.assertEquals(response['X-Computed'], '1')
+
+        response = cached_view(rf.get('/cached_view', data={'x': '1'},
+                                      HTTP_IF_NONE_MATCH=etag))
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(calls, [1])
+
+        response = cached_view(rf.get('/cached_view', data={'x': '2'}))
+        self.assertEquals(json.loads(response.content), {'x': 2})
+        self.assertEquals(calls, [1, 2])
+
+    @override_settings(DJANGO_API_COMPRESS_MIN_SIZE=100)
+    def test_json_compression(self):
+        """
+        Test that large JSON responses are gzipped when the client accepts it,
+        and small ones are left alone.
+        """
+        rf = RequestFactory()
+        request = rf.get('/compressed', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        data = {'numbers': list(range(1000))}
+
+        response = compress_response(request, JsonResponse(data))
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(response['Vary'], 'Accept-Encoding')
+        self.assertEquals(json.loads(gzip.decompress(response.content)), data)
+
+        response = compress_response(request, JsonResponseForbidden())
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        request = rf.get('/compressed', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        response = compress_response(request, JsonResponse(data))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        for i in range(5):
+            User.objects.create(username='user%d' % i)
+        request = rf.get('/compressed', HTTP_ACCEPT_ENCODING='gzip')
+        response = StreamingJsonResponse({'users': User.objects.all()},
+                                         chunk_size=2)
+        response.buffer_size = 10
+        response = compress_response(request, response)
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEquals(len(json.loads(content)['users']), 5)
+
+    @override_settings(DEBUG=True)
+    async def test_async_views(self):
+        """
+        Test that the decorators wrap async views with async wrappers.
+        """
+        user = await User.objects.acreate(username='async')
+
+        @api({
+            'accepts': {
+                'x': forms.IntegerField(),
+                'user': User(),
+            },
+            'returns': {
+                200: 'OK',
+            },
+        })
+        async def async_view(request):
+            return await ajson_response({
+                'x': request.GET['x'],
+                'user': request.GET['user'],
+                'users': User.objects.all(),
+            })
+
+        self.assertTrue(asyncio.iscoroutinefunction(async_view))
+        rf = RequestFactory()
+        response = await async_view(
+            rf.get('/async_view', data={'x': '1', 'user-id': user.id})
+        )
+        self.assertEquals(response.status_code, 200)
+        response_json = json.loads(response.content)
+        self.assertEquals(response_json['x'], 1)
+        self.assertEquals(response_json['user']['username'], 'async')
+        self.assertEquals(len(response_json['users']), 1)
+
+        response = await async_view(
+            rf.get('/async_view', data={'x': '1', 'user-id': 99999})
+        )
+        self.assertEquals(response.status_code, 404)
+
+        response = await async_view(rf.get('/async_view', data={'x': 'a'}))
+        self.assertEquals(response.status_code, 400)
+
+    @override_settings(DEBUG=True, DJANGO_API_TIMING=True,
+                       DJANGO_API_SERVER_TIMING=True)
+    def test_phase_timing(self):
+        """
+        Test that @api records the time spent in each phase.
+        """
+        @api({
+            'accepts': {
+                'user': User(),
+            },
+            'returns': {
+                200: 'OK',
+            },
+        })
+        def timed_view(request):
+            return JsonResponse({'user': request.GET['user']})
+
+        timing.registry.clear()
+        user = User.objects.create(username='timed')
+        rf = RequestFactory()
+        response = timed_view(rf.get('/timed_view', data={'user-id': user.id}))
+        self.assertEquals(response.status_code, 200)
+        phases = [phase.split(';')[0]
+                  for phase in response['Server-Timing'].split(', ')]
+        self.assertEquals(sorted(phases),
+                          ['encode', 'models', 'validate', 'view'])
+
+        snapshot = timing.registry.snapshot()
+        self.assertEquals(list(snapshot), [timing.endpoint_name(timed_view)])
+        self.assertEquals(
+            sorted(snapshot[timing.endpoint_name(timed_view)]['view']),
+            [50, 95, 99]
+        )
+
+        with override_settings(DJANGO_API_TIMING=False):
+            response = timed_view(
+                rf.get('/timed_view', data={'user-id': user.id})
+            )
+            self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_benchmarks(self):
+        """
+        Test that benchmarks run and that regressions against a baseline are
+        reported.
+        """
+        results = benchmarks.run(
+            [benchmarks.Benchmark('encode', lambda: JsonResponse({'x': 1}))],
+            min_time=0.01,
+        )
+        self.assertGreater(results['encode']['ops_per_sec'], 0)
+        self.assertGreater(results['encode']['peak_kb'], 0)
+
+        ops_per_sec = results['encode']['ops_per_sec']
+        self.assertEquals(benchmarks.compare(
+            results, {'encode': {'ops_per_sec': ops_per_sec * 1.1}}, 0.2
+        ), [])
+        self.assertEquals(benchmarks.compare(
+            results, {'encode': {'ops_per_sec': ops_per_sec * 2}}, 0.2
+        ), [('encode', ops_per_sec * 2, ops_per_sec)])
+
+    def test_api_endpoint(self):
+        """
+        Test that @api compiles its spec once, and exposes it.
+        """
+        @api({
+            'accepts': {
+                'x': forms.IntegerField(),
+                'user': User(),
+            },
+            'returns': {
+                200: 'OK',
+                403: 'Permission denied',
+            },
+        })
+        def simple_view(request):
+            return JsonResponse()
+
+        endpoint = simple_view.endpoint
+        self.assertIsInstance(endpoint, ApiEndpoint)
+        self.assertEquals(endpoint.view.__name__, 'simple_view')
+        self.assertEquals(endpoint.return_codes, [200, 403, 500])
+        self.assertEquals(list(endpoint.schema.form_class.base_fields), ['x'])
+        self.assertEquals([name for (name, lookup) in
+                           endpoint.schema.model_fields], ['user'])
+        self.assertIsNone(endpoint.cache)
+
+    @override_settings(DEBUG=False)
+    def test_sampled_validation(self):
+        """
+        Test that production response checks follow the sample rate and
+        mode, and that DEBUG mode always checks.
+        """
+        checks = []
+
+        def check(value):
+            checks.append(value)
+            return value
+
+        ValidationPolicy(sample_rate=0).run(check, 'never')
+        ValidationPolicy(sample_rate=1).run(check, 'always')
+        self.assertEquals(checks, ['always'])
+        with override_settings(DEBUG=True):
+            ValidationPolicy(sample_rate=0).run(check, 'debug')
+        self.assertEquals(checks, ['always', 'debug'])
+
+        with override_settings(DJANGO_API_VALIDATION_SAMPLE_RATE=0):
+            ValidationPolicy().run(check, 'global')
+        self.assertEquals(checks, ['always', 'debug'])
+
+        done = threading.Event()
+
+        def shadow_check(value):
+            checks.append(value)
+            done.set()
+
+        self.assertIsNone(
+            ValidationPolicy(mode='shadow').run(shadow_check, 'shadow')
+        )
+        self.assertTrue(done.wait(5))
+        self.assertEquals(checks, ['always', 'debug', 'shadow'])
+
+        self.assertRaises(ValueError, ValidationPolicy, mode='unknown')
+
+    def test_validate_json_request_schema(self):
+        """
+        Test that validate_json_request cleans typed bodies, reports errors
+        by path, and rejects oversized bodies before decoding them.
+        """
+        rf = RequestFactory()
+
+        spec = {
+            'name': forms.CharField(max_length=10),
+            'date': forms.DateField(),
+            'tags': [str],
+            'items': [{
+                'sku': str,
+                'quantity': forms.IntegerField(min_value=1),
+            }],
+            'extra': None,
+        }
+
+        @validate_json_request(spec, max_size=500)
+        def typed_view(request, request_dict):
+            return JsonResponse(request_dict)
+
+        def post(view, body):
+            return view(rf.post('/orders', data=json.dumps(body),
+                                content_type='application/json'))
+
+        body = {
+            'name': 'order',
+            'date': '2024-01-02',
+            'tags': ['a', 'b'],
+            'items': [{'sku': 'x1', 'quantity': '2', 'ignored': 1}],
+            'extra': {'anything': [1]},
+            'unknown': True,
+        }
+        response = post(typed_view, body)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), {
+            'name': 'order',
+            'date': '2024-01-02',
+            'tags': ['a', 'b'],
+            'items': [{'sku': 'x1', 'quantity': 2}],
+            'extra': {'anything': [1]},
+        })
+
+        body['tags'] = ['a', 1]
+        body['items'] = [{'sku': 'x1', 'quantity': 0}, {'quantity': 1}]
+        del body['extra']
+        (cleaned, errors) = JsonSchema(spec).clean(body)
+        self.assertEquals(
+            dict((error_path, list(messages))
+                 for (error_path, messages) in errors.items()),
+            {
+                'tags[1]': ['Expected a string.'],
+                'items[0].quantity': [
+                    'Ensure this value is greater than or equal to 1.'
+                ],
+                'items[1].sku': ['This field is required.'],
+                'extra': ['This field is required.'],
+            },
+        )
+        response = post(typed_view, body)
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(json.loads(response.content),
+                          'POST JSON failed to validate: %s' % dict(errors))
+
+        response = post(typed_view, {'name': 'x' * 600})
+        self.assertEquals(response.status_code, 413)
+
+        response = typed_view(rf.post('/orders', data='{"name": ',
+                                      content_type='application/json'))
+        self.assertEquals(response.status_code, 400)
+
+        @validate_json_request({'name', 'date'})
+        def untyped_view(request, request_dict):
+            return JsonResponse(request_dict)
+
+        body = {'name': 'order', 'date': 'any', 'other': 1}
+        response = post(untyped_view, body)
+        self.assertEquals(json.loads(response.content), body)
+        response = post(untyped_view, {'name': 'order'})
+        self.assertEquals(response.status_code, 400)
+
+    @override_settings(ROOT_URLCONF='django_api.tests', DEBUG=True)
+    def test_batch_view(self):
+        """
+        Test that a batch view dispatches each sub-request to its view and
+        returns every status and body in order.
+        """
+        batch = BatchView(max_workers=2)
+        rf = RequestFactory()
+
+        def post(sub_requests):
+            request = rf.post('/batch', data=json.dumps(sub_requests),
+                              content_type='application/json')
+            return batch(request)
+
+        response = post([
+            {'path': '/echo', 'params': {'x': 1}},
+            {'path': '/echo?x=2'},
+            {'path': '/echo', 'params': {'x': -1}},
+            {'path': '/missing'},
+            {'path': '/plain'},
+        ])
+        self.assertEquals(response.status_code, 200)
+        results = json.loads(response.content)
+        self.assertEquals(results[0], {
+            'status': 200, 'body': {'method': 'GET', 'x': 1},
+        })
+        self.assertEquals(results[1]['body'], {'method': 'GET', 'x': 2})
+        self.assertEquals(
+            [result['status'] for result in results], [200, 200, 400, 404, 400]
+        )
+
+        response = post([
+            {'method': 'POST', 'path': '/async', 'params': {'x': '3'}},
+            {'method': 'GET', 'path': '/echo', 'params': {'x': 4}},
+            {'method': 'POST', 'path': '/json', 'params': {'name': 'n'}},
+            {'method': 'POST', 'path': '/json', 'params': {}},
+        ])
+        self.assertEquals(json.loads(response.content), [
+            {'status': 202, 'body': {'x': 3}},
+            {'status': 200, 'body': {'method': 'GET', 'x': 4}},
+            {'status': 200, 'body': {'name': 'n'}},
+            {'status': 400, 'body': 'POST JSON failed to validate: '
+                                    '{\'name\': [\'This field is '
+                                    'required.\']}'},
+        ])
+
+        self.assertEquals(post([{'path': '/batch'}]).status_code, 200)
+        self.assertEquals(
+            json.loads(post([{'path': '/batch'}]).content)[0]['status'], 400
+        )
+        self.assertEquals(post([{'params': {}}]).status_code, 400)
+        self.assertEquals(post([{'path': '/echo'}] * 21).status_code, 400)
+        self.assertEquals(batch(rf.get('/batch')).status_code, 400)
+
+    def test_paginated_json_response(self):
+        """
+        Test that keyset pages follow the ordering forwards and backwards,
+        with one query per page.
+        """
+        User.objects.bulk_create([
+            User(username='user%02d' % i, is_staff=bool(i % 2))
+            for i in range(25)
+        ])
+        queryset = User.objects.filter(username__startswith='user')
+        field = CursorField()
+
+        def page(token, ordering=None):
+            with self.assertNumQueries(1):
+                response = PaginatedJsonResponse(
+                    queryset, field.clean(token), page_size=10,
+                    ordering=ordering,
+                )
+            content = json.loads(response.content)
+            names = [row['username'] for row in content['results']]
+            return (names, content['next'], content['prev'])
+
+        (names, next_cursor, prev_cursor) = page(None, ['username'])
+        self.assertEquals(names, ['user%02d' % i for i in range(10)])
+        self.assertIsNone(prev_cursor)
+        (names, next_cursor, prev_cursor) = page(next_cursor, ['username'])
+        self.assertEquals(names, ['user%02d' % i for i in range(10, 20)])
+        (names, last_cursor, _) = page(next_cursor, ['username'])
+        self.assertEquals(names, ['user%02d' % i for i in range(20, 25)])
+        self.assertIsNone(last_cursor)
+        (names, _, first_prev) = page(prev_cursor, ['username'])
+        self.assertEquals(names, ['user%02d' % i for i in range(10)])
+        self.assertIsNone(first_prev)
+
+        # Ties on is_staff are broken by the primary key.
+        seen = []
+        token = None
+        while True:
+            (names, token, _) = page(token, ['-is_staff'])
+            seen.extend(names)
+            if token is None:
+                break
+        self.assertEquals(len(seen), 25)
+        self.assertEquals(len(set(seen)), 25)
+        self.assertEquals(sorted(seen[:12]),
+                          ['user%02d' % i for i in range(1, 25, 2)])
+
+        self.assertRaises(forms.ValidationError, field.clean, 'not a cursor')
+
+        # Cursors that don't fit the keyset are bad requests.
+        for values in ([1], ['user01', 'x'], ['user01', None],
+                       ['user01', [1]]):
+            response = PaginatedJsonResponse(queryset, Cursor(values),
+                                             ordering=['username'])
+            self.assertEquals(response.status_code, 400)
+
+    @override_settings(DEBUG=True)
+    def test_sparse_fieldsets(self):
+        """
+        Test that a fields parameter is checked against the allow-list and
+        only reads and encodes the requested columns.
+        """
+        User.objects.create(username='sparse', email='sparse@example.com')
+
+        @api_accepts({
+            'fields': FieldsetField(['id', 'username', 'email']),
+        })
+        def sparse_view(request):
+            return JsonResponse({
+                'users': User.objects.filter(username='sparse'),
+                'first': User.objects.get(username='sparse'),
+            }, fields=request.GET['fields'])
+
+        rf = RequestFactory()
+        with CaptureQueriesContext(connection) as queries:
+            response = sparse_view(rf.get('/sparse', data={
+                'fields': 'username, email,username',
+            }))
+        content = json.loads(response.content)
+        expected = {'username': 'sparse', 'email': 'sparse@example.com'}
+        self.assertEquals(content, {'users': [expected], 'first': expected})
+        self.assertNotIn('password', queries[1]['sql'])
+
+        response = sparse_view(rf.get('/sparse'))
+        self.assertIn('password', json.loads(response.content)['first'])
+
+        response = sparse_view(rf.get('/sparse', data={
+            'fields': 'username,password',
+        }))
+        self.assertEquals(response.status_code, 400)
+
+        page = json.loads(PaginatedJsonResponse(
+            User.objects.all(), fields=('username',)
+        ).content)
+        self.assertEquals(page['results'], [{'username': 'sparse'}])
+
+        # Restricted serializers are shared by every ordering of the same
+        # fields, and their number is bounded.
+        serializer = model_serializers.get_serializer(User)
+        self.assertIs(serializer.restrict(('username', 'email')),
+                      serializer.restrict(('email', 'username', 'nope')))
+        for first in serializer.names:
+            for second in serializer.names:
+                for third in serializer.names:
+                    serializer.restrict((first, second, third))
+        self.assertTrue(len(serializer._restricted) <=
+                        model_serializers.MAX_RESTRICTED)
+
+        # An allowed name that isn't a field of the model projects to
+        # nothing, rather than to every column.
+        model_serializers.register(User, exclude=['password'])
+        self.addCleanup(model_serializers._registry.pop, User)
+        response = JsonResponse({'users': User.objects.all()},
+                                fields=('nonexistent',))
+        self.assertEquals(json.loads(response.content), {'users': [{}]})
+        response = StreamingJsonResponse({'users': User.objects.all()},
+                                         fields=('nonexistent',))
+        self.assertEquals(json.loads(b''.join(response.streaming_content)),
+                          {'users': [{}]})
+
+    def test_admission_control(self):
+        """
+        Test that rate and concurrency limits shed requests with 429 and
+        503 responses carrying Retry-After.
+        """
+        rf = RequestFactory()
+        request = rf.get('/limited')
+
+        @api({
+            'accepts': {},
+            'returns': {
+                200: 'OK',
+            },
+            'limits': {
+                'rate': 0.5,
+                'burst': 2,
+            },
+        })
+        def rate_limited_view(request):
+            return JsonResponse()
+
+        self.assertEquals(rate_limited_view(request).status_code, 200)
+        self.assertEquals(rate_limited_view(request).status_code, 200)
+        response = rate_limited_view(request)
+        self.assertEquals(response.status_code, 429)
+        self.assertEquals(response['Retry-After'], '2')
+        self.assertEquals(json.loads(response.content)['error_type'], 429)
+
+        nested = []
+
+        @api_limit(max_concurrent=1, retry_after=5)
+        def concurrency_limited_view(request):
+            if not nested:
+                nested.append(concurrency_limited_view(request))
+            return JsonResponse()
+
+        self.assertEquals(concurrency_limited_view(request).status_code, 200)
+        self.assertEquals(nested[0].status_code, 503)
+        self.assertEquals(nested[0]['Retry-After'], '5')
+        self.assertEquals(concurrency_limited_view(request).status_code, 200)
+
+        @api_limit(rate=1, burst=1, shared=True)
+        def shared_view(request):
+            return JsonResponse()
+
+        statuses = [shared_view(request).status_code for i in range(3)]
+        self.assertIn(429, statuses)
+
+        # Each request refreshes the shared counter's expiry, so in-flight
+        # requests are not forgotten while requests keep arriving.
+        # The cache's clock is patched instead of sleeping.
+        limit = SharedConcurrencyLimit('django_api:test:concurrency', 2,
+                                       timeout=10)
+        now = time.time()
+        with mock.patch('time.time') as clock:
+            clock.return_value = now
+            self.assertTrue(limit.acquire())
+            clock.return_value = now + 6
+            self.assertTrue(limit.acquire())
+            clock.return_value = now + 12
+            self.assertFalse(limit.acquire())
+            # Without requests, the counter expires.
+            clock.return_value = now + 23
+            self.assertTrue(limit.acquire())
+
+    def test_request_coalescing(self):
+        """
+        Test that concurrent identical GETs run the view once and share its
+        response, and that other processes' results are read from the cache.
+        """
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        @api({
+            'accepts': {
+                'x': forms.IntegerField(),
+            },
+            'returns': {
+                200: 'OK',
+            },
+            'coalesce': {},
+        })
+        def slow_view(request):
+            calls.append(request.GET['x'])
+            started.set()
+            release.wait(5)
+            return JsonResponse({'x': request.GET['x']})
+
+        rf = RequestFactory()
+        responses = []
+
+        def get(x):
+            responses.append(slow_view(rf.get('/slow', data={'x': x})))
+
+        leader = threading.Thread(target=get, args=['01'])
+        leader.start()
+        self.assertTrue(started.wait(5))
+        followers = [threading.Thread(target=get, args=['1'])
+                     for i in range(3)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEquals(calls, [1])
+        self.assertEquals(
+            [json.loads(response.content) for response in responses],
+            [{'x': 1}] * 4,
+        )
+
+        # A request whose leader runs in another process polls the cache.
+        @api_coalesce(shared=True, poll_interval=0.01)
+        def shared_view(request):
+            calls.append('shared')
+            return JsonResponse()
+
+        request = rf.get('/shared')
+        single_flight = coalescing.SingleFlight()
+        key = single_flight.make_key(request)
+        cache = caches['default']
+        cache.set(key, 'token')
+        cache.set(key + ':token', (200, b'{"cached":true}', []))
+        try:
+            response = shared_view(request)
+        finally:
+            cache.delete_many([key, key + ':token'])
+        self.assertEquals(json.loads(response.content), {'cached': True})
+        self.assertEquals(shared_view(request).status_code, 200)
+        self.assertEquals(calls, [1, 'shared'])
+
+    @override_settings(DEBUG=False)
+    def test_failure_aggregation(self):
+        """
+        Test that production validation failures are counted per endpoint,
+        field and code, and that only sampled exemplars are formatted.
+        """
+        sink = ListSink()
+        failures.aggregator.flush()
+        failures.register_sink(sink)
+        self.addCleanup(failures.unregister_sink, sink)
+
+        @api({
+            'accepts': {
+                'x': forms.IntegerField(min_value=0),
+            },
+            'returns': {
+                200: 'OK',
+            },
+        })
+        def lenient_view(request):
+            return JsonResponseAccepted()
+
+        rf = RequestFactory()
+        for i in range(10):
+            response = lenient_view(rf.get('/lenient', data={'x': -i - 1}))
+            self.assertEquals(response.status_code, 202)
+        lenient_view(rf.get('/lenient', data={'x': 'abc'}))
+        failures.aggregator.flush()
+
+        summaries = dict(
+            ((summary['field'], summary['code']), summary)
+            for summary in sink.summaries
+        )
+        self.assertEquals(set(summaries), set([
+            ('x', 'min_value'), ('x', 'invalid'),
+            ('response', 'undeclared_status'),
+        ]))
+        self.assertEquals(summaries[('x', 'min_value')]['count'], 10)
+        self.assertEquals(len(summaries[('x', 'min_value')]['exemplars']), 3)
+        self.assertEquals(
+            summaries[('response', 'undeclared_status')]['count'], 11
+        )
+        self.assertTrue(summaries[('x', 'invalid')]['endpoint'].endswith(
+            'lenient_view'
+        ))
+
+        sink.summaries = []
+        api_returns({200: 'OK'})(lambda request: HttpResponse())(
+            rf.get('/plain')
+        )
+        failures.aggregator.flush()
+        self.assertEquals(
+            [(summary['code'], summary['exemplars'])
+             for summary in sink.summaries],
+            [('not_json', ['returned HttpResponse'])],
+        )
+
+        formatted = []
+
+        def format_exemplar(i):
+            formatted.append(i)
+            return str(i)
+
+        aggregator = failures.FailureAggregator(flush_interval=3600,
+                                                max_exemplars=2)
+        for i in range(100):
+            aggregator.record('endpoint', 'field', 'code', format_exemplar, i)
+        self.assertEquals(formatted, [])
+        aggregator.flush()
+        self.assertEquals(len(formatted), 2)
+
+        # A burst followed by quiet is still flushed on schedule.
+        sink.summaries = []
+        aggregator = failures.FailureAggregator(flush_interval=0.05)
+        aggregator.record('endpoint', 'field', 'code')
+        deadline = time.monotonic() + 5
+        while not sink.summaries and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEquals([summary['count'] for summary in sink.summaries],
+                          [1])
+
+    def test_streamed_json_request(self):
+        """
+        Test that NDJSON and JSON array bodies are read incrementally and
+        validated record by record, with a summary of the rejected ones.
+        """
+        rf = RequestFactory()
+        imported = []
+
+        @validate_json_request({
+            'sku': str,
+            'quantity': forms.IntegerField(min_value=1),
+        }, stream=True, max_size=100)
+        def import_view(request, records):
+            for record in records:
+                imported.append(record)
+
+        lines = [
+            {'sku': 'a', 'quantity': 1},
+            {'sku': 'b', 'quantity': 0},
+            {'sku': 'c', 'quantity': '3', 'extra': True},
+            {'quantity': 4},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n\n'
+        response = import_view(rf.post('/import', data=body,
+                                       content_type='application/x-ndjson'))
+        self.assertEquals(response.status_code, 200)
+        summary = json.loads(response.content)
+        self.assertEquals(
+            (summary['received'], summary['accepted'], summary['rejected']),
+            (4, 2, 2),
+        )
+        self.assertEquals([error['index'] for error in summary['errors']],
+                          [1, 3])
+        self.assertIn('sku', summary['errors'][1]['errors'])
+        self.assertEquals(imported, [{'sku': 'a', 'quantity': 1},
+                                     {'sku': 'c', 'quantity': 3}])
+
+        response = import_view(rf.post(
+            '/import', data=json.dumps(lines[:1] * 3),
+            content_type='application/json',
+        ))
+        self.assertEquals(json.loads(response.content)['accepted'], 3)
+
+        response = import_view(rf.post(
+            '/import', data='[{"sku": "a", "quantity": 1}, {"sku"',
+            content_type='application/json',
+        ))
+        self.assertEquals(response.status_code, 400)
+        summary = json.loads(response.content)
+        self.assertEquals(summary['accepted'], 1)
+        self.assertIn('error', summary)
+
+        response = import_view(rf.post(
+            '/import', data='{"sku": "%s"}' % ('x' * 200),
+            content_type='application/x-ndjson',
+        ))
+        self.assertEquals(response.status_code, 400)
+
+        # Items split across chunks, including numbers and multi-byte
+        # characters, are decoded whole.
+        items = [12345, 'caf\u00e9 \u2603', {'a': [1, 2.5, None]}, [], True]
+        body = json.dumps(items, ensure_ascii=False).encode('utf-8')
+        for chunk_size in [1, 2, 3, 7]:
+            self.assertEquals(list(ingest.iter_json_array(
+                io.BytesIO(body), 1000, chunk_size=chunk_size
+            )), items)
+        self.assertEquals(
+            list(ingest.iter_json_array(io.BytesIO(b' [ ] '), 10)), []
+        )
+        for bad in [b'{}', b'[1 2]', b'[1,', b'[1] 2']:
+            self.assertRaises(ValueError, list, ingest.iter_json_array(
+                io.BytesIO(bad), 10, chunk_size=1
+            ))
+
+    def test_query_budget(self):
+        """
+        Test that queries run by the view and while encoding its response
+        are checked against the declared budget.
+        """
+        for i in range(3):
+            User.objects.create(username='budget%d' % i)
+
+        def budget_view(request):
+            users = list(User.objects.filter(username__startswith='budget'))
+            for user in users:
+                # An N+1 pattern.
+                list(user.groups.all())
+            return JsonResponse({'users': User.objects.all()})
+
+        within_budget = api({
+            'accepts': {},
+            'returns': {
+                200: 'OK',
+            },
+            'max_queries': 5,
+        })(budget_view)
+        over_budget = api_returns({200: 'OK'}, max_queries=4)(budget_view)
+
+        rf = RequestFactory()
+        with override_settings(DEBUG=True):
+            self.assertEquals(within_budget(rf.get('/budget')).status_code,
+                              200)
+            response = over_budget(rf.get('/budget'))
+            self.assertEquals(response.status_code, 400)
+            self.assertIn('ran 5 queries', response.content.decode())
+
+        sink = ListSink()
+        failures.aggregator.flush()
+        failures.register_sink(sink)
+        self.addCleanup(failures.unregister_sink, sink)
+        with override_settings(DEBUG=False):
+            self.assertEquals(over_budget(rf.get('/budget')).status_code, 200)
+            streaming = api_returns({200: 'OK'}, max_queries=0)(
+                lambda request: StreamingJsonResponse(User.objects.all())
+            )
+            b''.join(streaming(rf.get('/stream')).streaming_content)
+        failures.aggregator.flush()
+        self.assertEquals(
+            sorted((summary['code'], summary['count'])
+                   for summary in sink.summaries),
+            [('max_queries', 1), ('max_queries', 1)],
+        )
+
+    @override_settings(ROOT_URLCONF='django_api.tests', DEBUG=True)
+    def test_async_task(self):
+        """
+        Test that 'async_task' endpoints validate their input, then answer
+        with a 202 and run the view as a job whose response job_status
+        returns to the user who started it, with a bounded queue.
+        """
+        class InlineExecutor(object):
+            def submit(self, func, *args):
+                func(*args)
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def report_view(request):
+            started.set()
+            release.wait(5)
+            return JsonResponse({'total': request.GET['x'] * 2})
+
+        spec = {
+            'accepts': {
+                'x': forms.IntegerField(min_value=0),
+            },
+            'returns': {
+                200: 'OK',
+            },
+        }
+        inline = api(dict(spec, async_task={
+            'executor': InlineExecutor(),
+        }))(report_view)
+        background = api(dict(spec, async_task={
+            'max_pending': 1,
+        }))(report_view)
+
+        rf = RequestFactory()
+        self.assertEquals(inline(rf.get('/report', {'x': 'a'})).status_code,
+                          400)
+
+        release.set()
+        response = inline(rf.get('/report', {'x': 3}))
+        self.assertEquals(response.status_code, 202)
+        job_id = json.loads(response.content)['job_id']
+        self.assertEquals(response['Location'], '/jobs/%s' % job_id)
+        response = tasks.job_status(rf.get('/jobs'), job_id)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), {'total': 6})
+
+        # Jobs are only visible to the user who started them.
+        request = rf.get('/jobs')
+        request.user = User.objects.create(username='someone')
+        self.assertEquals(tasks.job_status(request, job_id).status_code, 404)
+
+        release.clear()
+        response = background(rf.get('/report', {'x': 4}))
+        self.assertEquals(response.status_code, 202)
+        job_id = json.loads(response.content)['job_id']
+        self.assertTrue(started.wait(5))
+        response = tasks.job_status(rf.get('/jobs'), job_id)
+        self.assertEquals(response.status_code, 202)
+        self.assertEquals(json.loads(response.content)['status'], 'running')
+        # The queue is bounded.
+        self.assertEquals(background(rf.get('/report', {'x': 1})).status_code,
+                          503)
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while (tasks.job_status(rf.get('/jobs'), job_id).status_code == 202
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        response = tasks.job_status(rf.get('/jobs'), job_id)
+        self.assertEquals(json.loads(response.content), {'total': 8})
+
+        # Jobs in a custom store are found by its own status view.
+        store = tasks.JobStore(timeout=60)
+        custom = api(dict(spec, async_task={
+            'executor': InlineExecutor(),
+            'store': store,
+        }))(report_view)
+        job_id = json.loads(custom(rf.get('/report', {'x': 5})).content)[
+            'job_id'
+        ]
+        status_view = tasks.job_status_view(store)
+        self.assertIs(tasks.job_status_view(store), status_view)
+        self.assertEquals(
+            json.loads(status_view(rf.get('/jobs'), job_id).content),
+            {'total': 10},
+        )
+
+        # Expired entries are not recreated without their owner.
+        store.delete(job_id)
+        self.assertFalse(store.update(job_id, status=tasks.DONE))
+        self.assertIsNone(store.get(job_id))
+
+    @override_settings(ROOT_URLCONF='django_api.tests', DEBUG=True)
+    def test_binary_content_negotiation(self):
+        """
+        Test that clients that accept msgpack get msgpack responses with the
+        same conversions as JSON, and that msgpack request bodies (single or
+        streamed) are decoded when the format is enabled.
+        """
+        backend = json_backends.get_binary_backend('application/msgpack')
+        if backend is None:
+            self.skipTest('msgpack is not installed')
+
+        @validate_json_request({
+            'name': str,
+            'when': forms.DateField(),
+        })
+        def create_view(request, request_dict):
+            return JsonResponse({
+                'name': request_dict['name'],
+                'when': datetime.date(2020, 1, 2),
+                'price': decimal.Decimal('1.50'),
+            })
+
+        @validate_json_request({'sku': str}, stream=True)
+        def import_view(request, records):
+            list(records)
+
+        rf = RequestFactory()
+        body = backend.dumps({'name': 'x', 'when': '2020-01-02'})
+        request = rf.post('/create', body, content_type='application/msgpack',
+                          HTTP_ACCEPT='application/msgpack, application/json')
+        response = create_view(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'application/msgpack')
+        self.assertEquals(response['Vary'], 'Accept')
+        # Same conversions as JSON.
+        self.assertEquals(backend.loads(response.content), {
+            'name': 'x', 'when': '2020-01-02', 'price': '1.50',
+        })
+
+        request = rf.post('/create', json.dumps({'name': 'x',
+                                                 'when': '2020-01-02'}),
+                          content_type='application/json',
+                          HTTP_ACCEPT='application/json, application/msgpack'
+                                      ';q=0.5')
+        response = create_view(request)
+        self.assertEquals(response['Content-Type'], 'application/json')
+        self.assertEquals(json.loads(response.content)['price'], '1.50')
+
+        body = b''.join(backend.dumps({'sku': sku})
+                        for sku in ('a', 'b', 7))
+        response = import_view(rf.post('/import', body,
+                                       content_type='application/msgpack'))
+        self.assertEquals(json.loads(response.content)['accepted'], 2)
+
+        with override_settings(DJANGO_API_BINARY_FORMATS=[]):
+            request = rf.post('/create', body,
+                              content_type='application/msgpack')
+            self.assertEquals(create_view(request).status_code, 400)
+
+        # @api views negotiate too, and batched sub-responses stay JSON.
+        response = batch_echo_view(rf.get('/echo', {'x': 3},
+                                          HTTP_ACCEPT='application/msgpack'))
+        self.assertEquals(backend.loads(response.content),
+                          {'method': 'GET', 'x': 3})
+        response = self.client.post(
+            '/batch', json.dumps([{'path': '/echo', 'params': {'x': 1}}]),
+            content_type='application/json', HTTP_ACCEPT='application/msgpack'
+        )
+        self.assertEquals(json.loads(response.content),
+                          [{'status': 200,
+                            'body': {'method': 'GET', 'x': 1}}])
+
+    @override_settings(DEBUG=True)
+    async def test_async_query_budget(self):
+        """
+        Test that an async view's budget only counts its own queries, not
+        those of async requests running at the same time.
+        """
+        started = asyncio.Event()
+
+        @api_returns({200: 'OK'}, max_queries=1)
+        async def budget_view(request):
+            await User.objects.acount()
+            started.set()
+            await asyncio.sleep(0.05)
+            return JsonResponse()
+
+        async def other_request():
+            await started.wait()
+            for i in range(5):
+                await User.objects.acount()
+
+        rf = RequestFactory()
+        (response, _) = await asyncio.gather(
+            budget_view(rf.get('/budget')), other_request()
+        )
+        self.assertEquals(response.status_code, 200)
+
+        @api_returns({200: 'OK'}, max_queries=1)
+        async def over_budget_view(request):
+            await User.objects.acount()
+            await User.objects.acount()
+            return JsonResponse()
+
+        response = await over_budget_view(rf.get('/budget'))
+        self.assertEquals(response.status_code, 400)
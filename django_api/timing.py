@@ -0,0 +1,221 @@
+import socket
+import threading
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+
+_current_timer = ContextVar('django_api_timer', default=None)
+
+_sinks = []
+
+
+class PhaseTimer(object):
+    """
+    Collects the time spent in each phase of one API request.
+
+    Phases nest (a JsonResponse is encoded inside the view), and each phase
+    is recorded exclusive of the phases nested in it.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.phases = {}
+        self._stack = []
+
+    def push(self, name):
+        self._stack.append([name, perf_counter(), 0.0])
+
+    def pop(self):
+        (name, started, nested) = self._stack.pop()
+        elapsed = perf_counter() - started
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+
+    def finish(self, response):
+        for sink in _sinks:
+            sink.record(self.endpoint, self.phases)
+        if (getattr(settings, 'DJANGO_API_SERVER_TIMING', False) and
+                hasattr(response, 'has_header')):
+            response['Server-Timing'] = ', '.join(
+                '%s;dur=%.3f' % (name, elapsed * 1000)
+                for (name, elapsed) in self.phases.items()
+            )
+
+
+class phase(object):
+    """
+    Context manager that times a phase of the current API request, if timing
+    is enabled:
+
+    with timing.phase('validate'):
+        ...
+
+    A phase named None is not timed.
+    """
+    __slots__ = ('name', 'timer')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timer = _current_timer.get() if self.name else None
+        if self.timer is not None:
+            self.timer.push(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timer is not None:
+            self.timer.pop()
+
+
+def endpoint_name(func):
+    return '%s.%s' % (func.__module__, getattr(func, '__qualname__',
+                                                 func.__name__))
+
+
+def instrument(wrapper, view):
+    """
+    Wrap a decorator's 'wrapper' so that, when the DJANGO_API_TIMING setting
+    is on, the outermost API decorator on 'view' times the request and
+    reports its phases to the registered sinks.
+    """
+    endpoint = endpoint_name(view)
+
+    if iscoroutinefunction(wrapper):
+        @wraps(wrapper)
+        async def async_timed_func(request, *args, **kwargs):
+            if (_current_timer.get() is not None or
+                    not getattr(settings, 'DJANGO_API_TIMING', False)):
+                return await wrapper(request, *args, **kwargs)
+            timer = PhaseTimer(endpoint)
+            token = _current_timer.set(timer)
+            try:
+                response = await wrapper(request, *args, **kwargs)
+            finally:
+                _current_timer.reset(token)
+            timer.finish(response)
+            return response
+        async_timed_func._django_api_wrapper = True
+        return async_timed_func
+
+    @wraps(wrapper)
+    def timed_func(request, *args, **kwargs):
+        if (_current_timer.get() is not None or
+                not getattr(settings, 'DJANGO_API_TIMING', False)):
+            return wrapper(request, *args, **kwargs)
+        timer = PhaseTimer(endpoint)
+        token = _current_timer.set(timer)
+        try:
+            response = wrapper(request, *args, **kwargs)
+        finally:
+            _current_timer.reset(token)
+        timer.finish(response)
+        return response
+    timed_func._django_api_wrapper = True
+    return timed_func
+
+
+def view_phase(func):
+    """
+    Return the phase name for calls to 'func' from an API decorator: 'view'
+    for the view itself, and None for another API decorator, whose own
+    phases are timed.
+    """
+    if getattr(func, '_django_api_wrapper', False):
+        return None
+    return 'view'
+
+
+class MemorySink(object):
+    """
+    Keeps the last 'max_samples' timings of each endpoint and phase in
+    memory, and reports percentiles over them.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, phases):
+        with self._lock:
+            for (name, elapsed) in phases.items():
+                key = (endpoint, name)
+                if key not in self._samples:
+                    self._samples[key] = deque(maxlen=self.max_samples)
+                self._samples[key].append(elapsed)
+
+    def percentiles(self, endpoint, name, percents=(50, 95, 99)):
+        """
+        Return a dict of percent => seconds for one endpoint and phase.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get((endpoint, name), ()))
+        if not samples:
+            return {}
+        return dict(
+            (percent, samples[min(len(samples) - 1,
+                                  int(len(samples) * percent / 100.0))])
+            for percent in percents
+        )
+
+    def snapshot(self):
+        """
+        Return {endpoint: {phase: {50: p50, 95: p95, 99: p99}}}.
+        """
+        with self._lock:
+            keys = list(self._samples)
+        result = {}
+        for (endpoint, name) in keys:
+            result.setdefault(endpoint, {})[name] = self.percentiles(
+                endpoint, name
+            )
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class StatsdSink(object):
+    """
+    Sends each phase as a StatsD timer ('<prefix>.<endpoint>.<phase>') over
+    UDP. Send errors are ignored.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='django_api'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def record(self, endpoint, phases):
+        packet = '\n'.join(
+            '%s.%s.%s:%.3f|ms' % (self.prefix, endpoint, name, elapsed * 1000)
+            for (name, elapsed) in phases.items()
+        )
+        try:
+            self._socket.sendto(packet.encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+
+def register_sink(sink):
+    """
+    Report request timings to 'sink', an object with a
+    record(endpoint, phases) method.
+    """
+    _sinks.append(sink)
+
+
+def unregister_sink(sink):
+    _sinks.remove(sink)
+
+
+# The default sink; see registry.snapshot().
+registry = MemorySink()
+register_sink(registry)
@@ -1,4 +1,5 @@
 import os
+from setuptools import find_packages
 from setuptools import setup
 
 
@@ -11,7 +12,7 @@ os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
 setup(
     name='django-api',
     version='0.1.3',
-    packages=['django_api'],
+    packages=find_packages(include=['django_api', 'django_api.*']),
     url='https://github.com/bipsandbytes/django-api',
     include_package_data=True,
     license='BSD License',